@@ -2,33 +2,41 @@ from __future__ import print_function
 # bot.py
 import os
 
+import asyncio
 import discord
 import re
 import random
 import time
 from dotenv import load_dotenv
-from typing import Optional, Sequence, Union, List, TypedDict
+from typing import Optional, Sequence, Union, List
 from datetime import datetime
-from collections import Counter
 
+import itertools
 import os.path
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
 import aiohttp
 import utils
+from ledger import Ledger, PlayerSnapshot
+from loopmonitor import LoopMonitor
+from eventtrace import TraceRecorder
+from lfm import LfmQueue, LfmRequest
+from packindex import PackIndex, pack_record, set_command
+from packjob import PackJob, PackJobs
+from storage import PlayerRow, SheetsStorage, SqliteStorage, cell_update
+from pool import Pool, SealedDeckEntry
+from sealeddeck import (CircuitOpenError, PoolNotFoundError, fetch_pool, pool_id_cache, pool_to_sealeddeck,
+                        sealeddeck_pool)
 
 load_dotenv()
 
-SEALEDDECK_URL = "https://sealeddeck.tech/api/pools"
-
-class SealedDeckEntry(TypedDict):
-    name: str
-    count: int
+# Maximum number of concurrent sealeddeck.tech requests made while reconciling pools
+RECONCILE_CONCURRENCY = 8
+# Changes to the LFM queue within this many seconds are folded into a single edit of the LFM post
+LFM_POST_DEBOUNCE_SECONDS = 2
+# Number of pending LFMs listed individually in the LFM post
+LFM_POST_LISTED = 10
+# The loss count whose pack column holds the LOTR league's fellowship pack
+FELLOWSHIP_LOSS = 11
 
 def arena_to_json(arena_list: str) -> Sequence[SealedDeckEntry]:
     """Convert a list of cards in arena format to a list of json cards"""
@@ -41,53 +49,12 @@ def arena_to_json(arena_list: str) -> Sequence[SealedDeckEntry]:
 
 def remove_cards(pool: Sequence[SealedDeckEntry], cards_to_remove: Sequence[SealedDeckEntry]) -> Sequence[SealedDeckEntry]:
     """Remove the given cards from the pool, decrementing counts or totally removing entries."""
-    counted: Counter[str] = Counter()
-    for card in pool:
-        counted[card["name"]] += card["count"]
-    for card in cards_to_remove:
-        counted[card["name"]] -= card["count"]
-    return [{"name": name, "count": count} for name, count in counted.items() if count > 0]
-
-async def sealeddeck_pool(pool_sealeddeck_id: str) -> Optional[Sequence[SealedDeckEntry]]:
-    resp_json = None
-
-    for attempt in range(3):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{SEALEDDECK_URL}/{pool_sealeddeck_id}") as resp:
-                    resp.raise_for_status()
-                    resp_json = await resp.json()
-        except:
-            continue
-        else:
-            break
-
-    if resp_json is not None:
-        return [*resp_json["sideboard"], *resp_json["deck"], *resp_json["hidden"]]
-    else:
-        return None
-
-async def pool_to_sealeddeck(
-        punishment_cards: Sequence[SealedDeckEntry], pool_sealeddeck_id: Optional[str] = None
-) -> str:
-    """Adds punishment cards to a sealeddeck.tech pool and returns the id"""
-    deck: dict[str, Union[Sequence[dict], str]] = {"sideboard": punishment_cards}
-    if pool_sealeddeck_id:
-        deck["poolId"] = pool_sealeddeck_id
-
-    for attempt in range(3):
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(SEALEDDECK_URL, json=deck) as resp:
-                    resp.raise_for_status()
-                    resp_json = await resp.json()
-        except:
-            continue
-        else:
-            break
-
-    return resp_json["poolId"]
+    return (Pool.from_entries(pool) - Pool.from_entries(cards_to_remove)).to_entries()
 
+def sealeddeck_id(cell: str) -> Optional[str]:
+    """Pull the sealeddeck.tech id out of a plain link or a HYPERLINK formula."""
+    id_match = re.search("\\.tech/(?P<id>[a-zA-Z0-9]+)", cell)
+    return id_match and id_match.group("id")
 
 async def update_message(message: discord.Message, new_content: str):
     """Updates the text contents of a sent bot message"""
@@ -107,10 +74,8 @@ async def message_member(member: Union[discord.Member, discord.User], message: s
 class PoolBot(discord.Client):
     def __init__(self, config: utils.Config, intents: discord.Intents, *args, **kwargs):
         self.booster_tutor = None
-        self.spreadsheet_id = None
         self.awaiting_boosters_for_user = None
         self.num_boosters_awaiting = None
-        self.active_lfm_message = None
         self.league_committee_channel = None
         self.bot_bunker_channel = None
         self.lfm_channel = None
@@ -118,19 +83,48 @@ class PoolBot(discord.Client):
         self.pool_channel = None
         self.side_quest_pools_channel = None
         self.dev_mode = None
-        self.pools_tab_id = None
-        self.pending_lfm_user_mention = None
         self.config = config
         self.league_start = datetime.fromisoformat('2022-06-22')
-        self.double_packs: dict[int, Sequence[SealedDeckEntry]] = dict()
+        self.ledger = Ledger(config.ledger_path)
+        self.ledger_sync_task = None
+        # Whether the ledger's unconfirmed writes are known to have reached storage during this run
+        self.ledger_writes_sent = False
+        self.loop_monitor = LoopMonitor(threshold=config.stall_threshold_seconds)
+        self.trace_recorder = TraceRecorder(config.trace_path) if config.trace_path else None
+        self.lfm_queue = LfmQueue(config.lfm_expiry_minutes * 60, self.lfm_expired)
+        # A single post in the LFM channel, edited in place as the queue changes
+        self.lfm_post = None
+        self.lfm_post_idle = True
+        self.lfm_post_dirty = False
+        self.lfm_post_task = None
+        self.pack_index = PackIndex(config.pack_index_path)
+        self.pack_jobs = PackJobs(config.pack_job_timeout_minutes * 60, self.pack_job_timed_out)
+        # Fire-and-forget tasks started from timer callbacks, kept here so they aren't garbage collected mid-run
+        self.background_tasks = set()
+        sheets = SheetsStorage(config.spreadsheet_id, config.pools_tab_id)
+        # With SQLite storage the sheet becomes a mirror, updated by sync_periodically
+        self.storage = SqliteStorage(config.storage_path, mirror=sheets) if config.storage == 'sqlite' else sheets
+        self.backfill_task = None
+        if config.sealeddeck_cache_path:
+            pool_id_cache.persist_to(config.sealeddeck_cache_path)
         super().__init__(intents=intents, *args, **kwargs)
 
+    def run_in_background(self, coro):
+        """Start a task from synchronous code, printing its exception (like a DM to a user who blocks DMs) on failure"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_task_done)
+
+    def background_task_done(self, task: asyncio.Task):
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"background task failed: {task.exception()!r}")
+
     async def on_ready(self):
         print(f'{self.user} has connected to Discord!')
         await self.user.edit(username='AGL Bot')
         # If this is true, posts will be limited to #bot-lab and #bot-bunker, and LFM DMs will be ignored.
         self.dev_mode = self.config.debug_mode == "active"
-        self.pools_tab_id = self.config.pools_tab_id
         self.pool_channel = self.get_channel(719933932690472970) if not self.dev_mode else self.get_channel(
             1065100936445448232)
         self.packs_channel = self.get_channel(798002275452846111) if not self.dev_mode else self.get_channel(
@@ -143,14 +137,17 @@ class PoolBot(discord.Client):
         self.league_committee_channel = self.get_channel(1052324453188632696) if not self.dev_mode else self.get_channel(
             1065101182525259866)
         self.side_quest_pools_channel = self.get_channel(1055515435073806387)
-        self.pending_lfm_user_mention = None
-        self.active_lfm_message = None
         self.num_boosters_awaiting = 0
         self.awaiting_boosters_for_user = None
-        self.spreadsheet_id = self.config.spreadsheet_id
         for user in self.users:
             if user.name == 'Booster Tutor':
                 self.booster_tutor = user
+        # on_ready can fire again after a reconnect, so only start the sync loop once
+        if self.ledger_sync_task is None:
+            self.ledger_sync_task = asyncio.create_task(self.sync_periodically())
+        self.loop_monitor.start()
+        if self.backfill_task is None:
+            self.backfill_task = asyncio.create_task(self.backfill_pack_index())
         #
         # for member in self.guilds[0].members:
         #     if member.bot:
@@ -163,25 +160,34 @@ class PoolBot(discord.Client):
         # await self.message_members_not_in_league("Wilds")
 
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
+        if self.trace_recorder:
+            self.trace_recorder.record(self, 'edit', after, before)
+        self.index_pack(after)
         # Booster tutor adds sealeddeck.tech links as part of an edit operation
         if before.author == self.booster_tutor:
             if before.channel == self.pool_channel and "Sealeddeck.tech link" not in before.content and\
                     "Sealeddeck.tech link" in after.content:
                 # Edit adds a sealeddeck link
+                LoopMonitor.label_current_task('track_starting_pool')
                 await self.track_starting_pool(after)
                 return
 
     async def on_message(self, message: discord.Message):
+        if self.trace_recorder:
+            self.trace_recorder.record(self, 'message', message)
+        self.index_pack(message)
         # As part of the !playerchoice flow, repost Booster Tutor packs in pack-generation with instructions for
         # the appropriate user to select their pack.
         if (message.channel == self.bot_bunker_channel and message.author == self.booster_tutor
                 and message.mentions[0] == self.user):
+            LoopMonitor.label_current_task('handle_booster_tutor_response')
             await self.handle_booster_tutor_response(message)
             return
 
         if message.author == self.booster_tutor:
             if message.channel == self.packs_channel and "```" in message.content:
                 # Message is a generated pack
+                LoopMonitor.label_current_task('track_pack')
                 await self.track_pack(message)
                 return
 
@@ -196,6 +202,7 @@ class PoolBot(discord.Client):
             argument = message.content.split('"')[1]
         elif ' ' in message.content:
             argument = argv[1]
+        LoopMonitor.label_current_task(command)
 
         if not message.guild:
             # For now, only allow Sawyer to send broadcasts
@@ -227,6 +234,22 @@ class PoolBot(discord.Client):
         if command == '!collect' and message.channel == self.packs_channel:
             await self.collect(message, argument)
 
+        if command == '!reconcileledger' and message.channel == self.league_committee_channel:
+            await self.reconcile_ledger(message)
+            return
+
+        if command == '!reconcilepools' and message.channel == self.league_committee_channel:
+            await self.reconcile_pools(message, argument)
+            return
+
+        if command == '!loopstats' and message.channel == self.league_committee_channel:
+            await message.reply(self.loop_monitor.summary())
+            return
+
+        if command == '!packs' and message.channel == self.league_committee_channel and message.mentions:
+            await self.audit_packs(message, message.mentions[0])
+            return
+
         if command == '!randint':
             args = argv[1].split(None)
             if len(args) == 1:
@@ -244,7 +267,7 @@ class PoolBot(discord.Client):
         elif command == '!help':
             await message.channel.send(
                 f"You can give me one of the following commands:\n"
-                f"> `!challenge`: Challenges the current player in the LFM queue\n"
+                f"> `!challenge`: Challenges the longest-waiting player in the LFM queue\n"
                 f"> `!randint A B`: Generates a random integer n, where A <= n <= B. If only one input is given, "
                 f"uses that value as B and defaults A to 1. \n "
                 f"> `!help`: shows this message\n"
@@ -276,56 +299,58 @@ class PoolBot(discord.Client):
 
         last_6 = "!from a-mkm|lci|woe|mom|one|bro"
 
-        # Get sealeddeck link and loss count from spreadsheet
-        spreadsheet_values = await self.get_spreadsheet_values('Pools!B7:AA200')
-        curr_row = 6
-        for row in spreadsheet_values:
-            curr_row += 1
-            if len(row) < 5:
-                continue
-            if row[0].lower() != '' and row[0].lower() in message.author.display_name.lower():
-                losses = int(row[2])
-                clues_available = int(row[15])
-                if clues_available < clues_to_spend:
-                    await message.reply(f'By my records, you do not have enough clues. If this is in error, '
-                                        f'please post in {self.league_committee_channel.mention}')
-                    return
-
-                if losses == 0:
-                    await message.reply(f'It looks like you don\'t have a pack to reroll yet. If this is in error, '
-                                        f'please post in {self.league_committee_channel.mention}')
-                    return
-
-                # Mark the clues as used
-                self.sheet.values().update(spreadsheetId=self.spreadsheet_id,
-                                           range=f'Pools!R{curr_row}:R{curr_row}', valueInputOption='USER_ENTERED',
-                                           body={'values': [[int(row[16]) + clues_to_spend]]}).execute()
-
-                if clues_to_spend == 2:
-                    await self.packs_channel.send(f"{last_6} {message.author.mention}")
-                elif clues_to_spend == 4:
-                    await self.packs_channel.send(f"!from {'|'.join(sets)} {message.author.mention}")
-                elif clues_to_spend == 6:
-                    # ripped from prompt_user_pick
-                    while self.awaiting_boosters_for_user is not None:
-                        time.sleep(3)
-
-                    booster_one_type = f"!{sets[0]}"
-                    booster_two_type = f"!{sets[1]}"
-                    self.num_boosters_awaiting = 2
-                    self.awaiting_boosters_for_user = message.author
-
-                    # Generate two packs of the specified types
-                    await self.bot_bunker_channel.send(booster_one_type)
-                    await self.bot_bunker_channel.send(booster_two_type)
-                elif clues_to_spend == 10:
-                    self.double_packs[message.author.id] = []
-                    await self.packs_channel.send(f"!{sets[0]} {message.author.mention}")
-                    await self.packs_channel.send(f"!{sets[1]} {message.author.mention}")
-                    # TODO MKM replace pack with both???
-                return
-        await message.reply(f'Hmm, I can\'t find you in the league spreadsheet. '
-                            f'Please post in {self.league_committee_channel.mention}')
+        # Clue balances and loss counts come from the ledger rather than a fresh spreadsheet read
+        player = await self.ledger_player(message.author.display_name, 'clue', clues_to_spend, needs_loss=True)
+        if player is None:
+            await message.reply(f'Hmm, I can\'t find you in the league spreadsheet. '
+                                f'Please post in {self.league_committee_channel.mention}')
+            return
+        if self.ledger.balance(player, 'clue') < clues_to_spend:
+            await message.reply(f'By my records, you do not have enough clues. If this is in error, '
+                                f'please post in {self.league_committee_channel.mention}')
+            return
+
+        if player.losses == 0:
+            await message.reply(f'It looks like you don\'t have a pack to reroll yet. If this is in error, '
+                                f'please post in {self.league_committee_channel.mention}')
+            return
+
+        if clues_to_spend == 10 and message.author.id in self.pack_jobs:
+            await message.reply("I'm still waiting on the packs from your last `!collect 10`. Please try again once "
+                                "they've been recorded.")
+            return
+
+        if clues_to_spend == 2:
+            commands = [f"{last_6} {message.author.mention}"]
+        elif clues_to_spend == 4:
+            commands = [f"!from {'|'.join(sets)} {message.author.mention}"]
+        else:
+            commands = [f"!{sets[0]} {message.author.mention}", f"!{sets[1]} {message.author.mention}"]
+
+        # Mark the clues as used. The spreadsheet total is updated by the next ledger sync.
+        self.ledger.record(player, 'clue', clues_to_spend, ' '.join(commands))
+
+        if clues_to_spend in [2, 4]:
+            await self.send_pack_command(message.author, commands[0])
+        elif clues_to_spend == 6:
+            # ripped from prompt_user_pick
+            while self.awaiting_boosters_for_user is not None:
+                time.sleep(3)
+
+            booster_one_type = f"!{sets[0]}"
+            booster_two_type = f"!{sets[1]}"
+            self.num_boosters_awaiting = 2
+            self.awaiting_boosters_for_user = message.author
+
+            # Generate two packs of the specified types
+            await self.bot_bunker_channel.send(booster_one_type)
+            await self.bot_bunker_channel.send(booster_two_type)
+        elif clues_to_spend == 10:
+            # Both packs are recorded together as this loss's pack, see track_pack
+            job = self.pack_jobs.start(message.author.id, [f"!{sets[0]}", f"!{sets[1]}"],
+                                       f"!collect 10 {' '.join(sets)}")
+            await self.send_pack_command(message.author, commands[0], job)
+            await self.send_pack_command(message.author, commands[1], job)
 
     async def explore(self, message: discord.Message):
         possible_sets = [
@@ -359,30 +384,218 @@ class PoolBot(discord.Client):
             "XLN",
         ]
         set_to_generate = random.choice(possible_sets)
-        # Get sealeddeck link and loss count from spreadsheet
-        spreadsheet_values = await self.get_spreadsheet_values('Pools!B7:R200')
+        player = await self.ledger_player(message.author.display_name, 'map', 1)
+        if player is None:
+            await message.reply(f'Hmm, I can\'t find you in the league spreadsheet. '
+                                f'Please post in {self.league_committee_channel.mention}')
+            return
+        if self.ledger.balance(player, 'map') <= 0:
+            await message.reply(f'By my records, you do not have any unused maps. If this is in error, '
+                                f'please post in {self.league_committee_channel.mention}')
+            return
+
+        # Mark the map as used, then roll a new pack
+        command = f'!{set_to_generate} {message.author.mention} follows a map to uncharted territory'
+        self.ledger.record(player, 'map', 1, command)
+        await self.send_pack_command(message.author, command)
+
+    async def send_pack_command(self, owner: Union[discord.Member, discord.User], command: str,
+                                job: Optional[PackJob] = None):
+        """Post a Booster Tutor command in the packs channel, noting it so track_pack can match the pack to it"""
+        sent = self.pack_jobs.sent(owner.id, set_command(command), job)
+        sent.message_id = (await self.packs_channel.send(command)).id
+
+    async def ledger_player(self, display_name: str, resource: str, amount: int,
+                            needs_loss: bool = False) -> Optional[PlayerSnapshot]:
+        """
+        Look up a player in the ledger's cached spreadsheet snapshot. If the snapshot would get the command refused
+        (they're missing, look short on the resource, or have no losses yet when `needs_loss` is set), re-read the
+        sheet once in case it changed since the last sync.
+        """
+        player = self.ledger.find_player(display_name)
+        if (player is None or self.ledger.balance(player, resource) < amount
+                or (needs_loss and player.losses == 0)):
+            await self.storage.refresh_sheet_owned()
+            self.ledger.load_snapshot(await self.storage.rows())
+            player = self.ledger.find_player(display_name)
+        return player
+
+    async def sync_ledger(self):
+        """
+        Refresh the ledger's snapshot, push any unsynced spends to storage in a single batch, and sync the storage.
+        Spends only settle once the sync succeeds, since the balance columns are formulas only the sheet recomputes.
+        """
+        if self.ledger.unconfirmed_writes and not self.ledger_writes_sent:
+            # The last batch may not have reached storage: it failed, or the bot stopped before it was sent
+            await self.storage.write(self.ledger.unconfirmed_writes)
+            self.ledger_writes_sent = True
+        through = self.ledger.synced_through
+        spreadsheet_values = await self.storage.rows()
+        if spreadsheet_values:
+            self.ledger.load_snapshot(spreadsheet_values)
+            through, data = self.ledger.pending_updates(spreadsheet_values)
+            if data:
+                self.ledger.record_write(through, data)
+                self.ledger_writes_sent = False
+                await self.storage.write(data)
+                self.ledger_writes_sent = True
+        # Mirror the ledger's writes (and anything else written locally) right away
+        if await self.storage.sync():
+            self.ledger.mark_synced(through)
+
+    async def sync_periodically(self):
+        while True:
+            try:
+                await self.sync_ledger()
+            except Exception as e:
+                print(f"sync failed: {e}")
+            await asyncio.sleep(self.config.ledger_sync_seconds)
+
+    async def reconcile_ledger(self, message: discord.Message):
+        """Compare the ledger's balances against the sheet, report differences, then adopt the sheet's values"""
+        expected = {name: {resource: self.ledger.balance(player, resource) for resource in player.balances}
+                    for name, player in self.ledger.players.items()}
+        await self.storage.sync()
+        await self.sync_ledger()
+        differences = []
+        for name, player in self.ledger.players.items():
+            for resource, balance in expected.get(name, {}).items():
+                actual = self.ledger.balance(player, resource)
+                if actual != balance:
+                    differences.append(f'> {name}: {resource}s {balance} -> {actual}')
+        spent = self.ledger.spent_totals()
+        unconfirmed = len([event for event in self.ledger.events if event.seq > self.ledger.synced_through])
+        summary = (f'Ledger reconciled: {len(self.ledger.events)} spend(s) recorded across '
+                   f'{len({player for player, _ in spent})} player(s), ')
+        if unconfirmed == 0:
+            summary += 'all synced to the sheet.'
+        elif self.config.storage == 'sqlite':
+            summary += (f'but {unconfirmed} of them are only in local storage so far, because the sheet couldn\'t be '
+                        f'reached. They still count against balances and will be pushed on the next sync.')
+        else:
+            summary += (f'but {unconfirmed} of them haven\'t reached the sheet yet. They still count against '
+                        f'balances and will be pushed on the next sync.')
+        if differences:
+            summary += '\nThe sheet disagreed with the ledger for:\n' + '\n'.join(differences)
+        else:
+            summary += '\nNo differences found.'
+        await message.reply(summary[:2000])
+
+    async def reconcile_pools(self, message: discord.Message, argument: str):
+        """
+        Rebuild every player's pool from their starting pool, pack links and extra cards, and repost any pool that
+        doesn't match the one linked in column E, or that is missing because column E is empty or garbled or
+        sealeddeck.tech no longer has it. Players with a missing or unreadable pack link are skipped rather than
+        rebuilt without that pack. Pass `dry` to report differences without changing anything.
+        """
+        dry_run = argument.strip().lower() == 'dry'
+        status = await message.reply(':hourglass: Reconciling pools...')
+
+        # Take a single snapshot of the sheet. Pack links are HYPERLINK formulas, so read formulas as well.
+        spreadsheet_values, spreadsheet_formulas = await self.storage.rows_and_formulas()
+        semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+
+        async def fetch(pool_id: Optional[str]) -> Optional[Sequence[SealedDeckEntry]]:
+            """None if there's no pool to fetch. Errors other than PoolNotFoundError are worth trying again later."""
+            if not pool_id:
+                return None
+            async with semaphore:
+                return await fetch_pool(pool_id)
+
+        async def fetch_current(pool_id: Optional[str]) -> Optional[Sequence[SealedDeckEntry]]:
+            try:
+                return await fetch(pool_id)
+            except PoolNotFoundError:
+                # The pool is gone, so it gets rebuilt like an empty column E
+                return None
+
+        async def reconcile_row(player: PlayerRow) -> Optional[dict]:
+            name = player.name
+            current_id = sealeddeck_id(player.pool_link)
+            start_id = sealeddeck_id(player.starting_pool_link)
+            if not start_id:
+                return {'name': name, 'status': 'skipped'}
+            pack_ids = [sealeddeck_id(player.pack_link(loss)) for loss in range(1, player.losses + 1)]
+            # A fellowship pack is only expected if its column holds a pack link, but a link we can't read still counts
+            fellowship_link = player.pack_link(FELLOWSHIP_LOSS)
+            if player.losses < FELLOWSHIP_LOSS and ('HYPERLINK' in fellowship_link or '.tech/' in fellowship_link):
+                pack_ids.append(sealeddeck_id(fellowship_link))
+            # Never repost a pool rebuilt without one of its packs: the pack may have been added to column E by hand
+            if not all(pack_ids):
+                return {'name': name, 'status': 'skipped'}
+            extra_cards = [{"name": card, "count": 1} for card in player.extra_cards]
+
+            parts = await asyncio.gather(fetch_current(current_id), fetch(start_id),
+                                         *[fetch(pack_id) for pack_id in pack_ids], return_exceptions=True)
+            errors = [part for part in parts if isinstance(part, Exception)]
+            if any(isinstance(error, PoolNotFoundError) for error in errors):
+                # The starting pool or a pack is gone from sealeddeck.tech, so there's nothing complete to rebuild from
+                return {'name': name, 'status': 'skipped'}
+            if errors:
+                return {'name': name, 'status': 'failed'}
+            current_pool, *expected_parts = parts
+            expected = Pool.from_entries(extra_cards)
+            for part in expected_parts:
+                expected += Pool.from_entries(part)
+            if current_pool is not None and Pool.from_entries(current_pool) == expected:
+                return None
+            expected_pool = expected.to_entries()
+            if dry_run:
+                return {'name': name, 'status': 'differs' if current_pool is not None else 'missing'}
+            try:
+                async with semaphore:
+                    new_pool_id = await pool_to_sealeddeck(expected_pool)
+            except:
+                return {'name': name, 'status': 'failed'}
+            return {'name': name, 'status': 'reposted', 'data': [
+                cell_update('E', player.row, f'https://sealeddeck.tech/{new_pool_id}'),
+                cell_update('AA', player.row, len(extra_cards)),
+            ]}
+
+        jobs = []
         curr_row = 6
-        for row in spreadsheet_values:
+        for (row, formulas) in zip(spreadsheet_values, spreadsheet_formulas):
             curr_row += 1
-            if len(row) < 5:
+            if len(row) < 5 or row[0] == '':
                 continue
-            if row[0].lower() != '' and row[0].lower() in message.author.display_name.lower():
-                if int(row[16]) <= 0:
-                    await message.reply(f'By my records, you do not have any unused maps. If this is in error, '
-                                        f'please post in {self.league_committee_channel.mention}')
-                    return
-
-                # Mark the map as used
-                self.sheet.values().update(spreadsheetId=self.spreadsheet_id,
-                                           range=f'Pools!Q{curr_row}:Q{curr_row}', valueInputOption='USER_ENTERED',
-                                           body={'values': [[int(row[15]) + 1]]}).execute()
-
-                # Roll a new pack
-                await self.packs_channel.send(
-                    f'!{set_to_generate} {message.author.mention} follows a map to uncharted territory')
-                return
-        await message.reply(f'Hmm, I can\'t find you in the league spreadsheet. '
-                            f'Please post in {self.league_committee_channel.mention}')
+            jobs.append(reconcile_row(PlayerRow(curr_row, row, formulas)))
+        results = [result for result in await asyncio.gather(*jobs) if result is not None]
+
+        # Write every reposted pool in one request
+        await self.storage.write([update for result in results for update in result.get('data', [])])
+
+        summary = f'Checked {len(jobs)} pool(s); {len(jobs) - len(results)} already matched.'
+        for status_name in ['differs', 'missing', 'reposted', 'failed', 'skipped']:
+            names = [result['name'] for result in results if result['status'] == status_name]
+            if names:
+                summary += f'\n> {status_name}: {", ".join(names)}'
+        await update_message(status, summary[:2000])
+
+    def index_pack(self, message: discord.Message):
+        if message.channel != self.packs_channel and message.channel != self.pool_channel:
+            return
+        record = pack_record(message, self.booster_tutor, self.user, self.pool_channel)
+        if record is not None:
+            self.pack_index.add(record)
+        self.pack_index.note_newest(message.channel.id, message.id)
+
+    async def backfill_pack_index(self):
+        for channel in [self.packs_channel, self.pool_channel]:
+            try:
+                await self.pack_index.backfill(
+                    channel, lambda message: pack_record(message, self.booster_tutor, self.user, self.pool_channel))
+            except discord.errors.HTTPException as e:
+                print(f"pack index backfill of {channel} stopped: {e}")
+
+    async def audit_packs(self, message: discord.Message, member: Union[discord.Member, discord.User]):
+        records = self.pack_index.packs_for(member.id)
+        if not records:
+            await message.reply(f'I don\'t have any packs indexed for {member.display_name}.')
+            return
+        lines = [f'Latest {len(records)} pack(s) for {member.display_name}:']
+        for record in records:
+            lines.append(f'> {record.created_at[:10]} {record.kind} {record.set_command or ""} {record.jump_url}')
+        await message.reply('\n'.join(lines)[:2000])
 
     async def track_starting_pool(self, message: discord.Message):
         # Handle cases where Booster Tutor fails to generate a sealeddeck.tech link
@@ -395,31 +608,19 @@ class PoolBot(discord.Client):
             re.search("(?P<url>https?://[^\s]+)", message.content).group("url").split('sealeddeck.tech/')[1]
         sealed_deck_link = f'https://sealeddeck.tech/{sealed_deck_id}'
 
-        spreadsheet_values = await self.get_spreadsheet_values('Pools!B7:F200')
-
-        curr_row = 6
-        for row in spreadsheet_values:
-            curr_row += 1
-            if len(row) < 1:
-                continue
-            if row[0].lower() != '' and row[0].lower() in message.mentions[0].display_name.lower():
-                # Update the proper cell in the spreadsheet
-                body = {
-                    'values': [
-                        # [f'=HYPERLINK("{sealed_deck_link}", "Link")', f'=HYPERLINK("{sealed_deck_link}", "Link")'],
-                        [sealed_deck_link, sealed_deck_link],
-                    ],
-                }
-                self.sheet.values().update(spreadsheetId=self.spreadsheet_id,
-                                           range=f'Pools!E{curr_row}:F{curr_row}', valueInputOption='USER_ENTERED',
-                                           body=body).execute()
-                self.sheet.values().update(spreadsheetId=self.spreadsheet_id,
-                                           range=f'Pools!S{curr_row}:S{curr_row}', valueInputOption='USER_ENTERED',
-                                           body={'values': [[sealed_deck_link]]}).execute()
+        # New players are added on the sheet, possibly since storage last synced
+        await self.storage.refresh_sheet_owned()
+        player = await self.storage.find_player(message.mentions[0].display_name, min_cells=1)
+        if player is None:
+            # TODO do something if the value could not be found
+            return
 
-                return
-        # TODO do something if the value could not be found
-        return
+        # Update the proper cells in the spreadsheet
+        await self.storage.write([
+            # [f'=HYPERLINK("{sealed_deck_link}", "Link")', f'=HYPERLINK("{sealed_deck_link}", "Link")'],
+            {'range': f'Pools!E{player.row}:F{player.row}', 'values': [[sealed_deck_link, sealed_deck_link]]},
+            cell_update('S', player.row, sealed_deck_link),
+        ])
 
     async def track_pack(self, message: discord.Message):
         """
@@ -427,63 +628,56 @@ class PoolBot(discord.Client):
         If a pack has already been recorded for the current loss, this will _replace_ that pack.
         """
 
-        # Get sealeddeck link and loss count from spreadsheet
-        spreadsheet_values = await self.get_spreadsheet_values('Pools!B7:AA200')
-        spreadsheet_formulas = await self.get_spreadsheet_values('Pools!B7:AA200', valueRenderOption="FORMULA")
-        curr_row = 6
-        current_pool = 'Not found'
-        extra_cards = []
-        extra_card_count = 0
-        loss_count = 0
-        pack_to_replace = None
-        for (row, formulas) in zip(spreadsheet_values, spreadsheet_formulas):
-            curr_row += 1
-            if len(row) < 5:
-                continue
-            if row[0].lower() != '' and row[0].lower() in message.mentions[len(message.mentions) - 1].display_name.lower():
-                current_pool = row[3]
-                # Columns T through Z inclusive have extra cards
-                extra_cards = [{"name": card, "count": 1} for card in row[(ord('T') - ord('B')):(ord('Z')-ord('B')+1)] if card != '']
-                # Column AA has extra card count
-                extra_card_count = int(row[ord('Z')-ord('B')+1])
-                loss_count = int(row[2])
-                replace_id_match = re.search("\\.tech/(?P<id>[a-zA-Z0-9]*)", formulas[ord('F') - ord('B') + loss_count])
-                pack_to_replace = replace_id_match and replace_id_match.group("id")
-                break
-        if current_pool == 'Not found':
+        pack_content = message.content.split("```")[1].strip()
+        pack_json = arena_to_json(pack_content)
+
+        # Multi-pack rewards wait for every pack to arrive, then get recorded as one pack. Nothing is read until then.
+        # Packs from other commands, like an !explore that lands in between, aren't part of the job.
+        reply_to = message.reference.message_id if message.reference else None
+        job = self.pack_jobs.add(message.mentions[-1].id, set_command(message.content), reply_to, pack_json)
+        if job is not None:
+            if job.expired:
+                # The committee was told to add this job's packs by hand, so recording it now would undo their fix
+                await self.league_committee_channel.send(
+                    f"A pack for <@{job.owner_id}>'s `{job.description}` arrived after it timed out, so I didn't "
+                    f"record it: {message.jump_url}"
+                )
+                return
+            if not job.complete:
+                return
+            pack_json = job.cards()
+
+        # Get sealeddeck link and loss count from storage. Losses are only ever entered on the sheet, so make sure
+        # storage has the latest count before deciding which pack column to write.
+        await self.storage.refresh_sheet_owned()
+        player = await self.storage.find_player(message.mentions[-1].display_name, formulas=True)
+        if player is None:
             # This should only happen during debugging / spreadsheet setup
             print("rut row")
             return
+        curr_row = player.row
+        current_pool = player.pool_link
+        extra_cards = [{"name": card, "count": 1} for card in player.extra_cards]
+        extra_card_count = player.extra_card_count
+        loss_count = player.losses
+        pack_to_replace = sealeddeck_id(player.pack_link(loss_count))
 
         # For LOTR league, there's a special column for fellowship packs
         if "Fellowship" in message.content:
-            loss_count = 11
-
-        pack_content = message.content.split("```")[1].strip()
-        pack_json = arena_to_json(pack_content)
-
-        # If this is a double pack, wait for the second pack to be resolved, then treat both as one
-        if message.mentions[-1].id in self.double_packs:
-            double_pack = self.double_packs[message.mentions[-1].id]
-            if len(double_pack) == 0:
-                double_pack.append(pack_json)
-                return
-            else:
-                pack_json = [*double_pack[0], *pack_json]
-                del self.double_packs[message.mentions[-1].id]
+            loss_count = FELLOWSHIP_LOSS
 
         try:
             new_pack_id = await pool_to_sealeddeck(pack_json)
         except:
             print("sealeddeck issue — generating pack")
             # If something goes wrong with sealeddeck, highlight the pack cell red
-            await self.set_cell_to_red(curr_row, chr(ord('F') + loss_count))
+            await self.storage.mark_error(curr_row, chr(ord('F') + loss_count))
             return
 
         await self.write_pack(new_pack_id, loss_count, curr_row)
 
         if current_pool == '':
-            await self.set_cell_to_red(curr_row, chr(ord('F') + loss_count))
+            await self.storage.mark_error(curr_row, chr(ord('F') + loss_count))
             return
 
         try:
@@ -495,13 +689,14 @@ class PoolBot(discord.Client):
             else:
                 pool_contents = await sealeddeck_pool(current_pool.split('.tech/')[1])
                 cards_to_replace = await sealeddeck_pool(pack_to_replace)
-                pool_without_old_cards = remove_cards(pool_contents, cards_to_replace)
-                 # TODO MKM verify that they can just be concatenated not added
-                updated_pool_id = await pool_to_sealeddeck([*pool_without_old_cards, *pack_json])
+                # Merge rather than concatenate so the new pack's cards don't show up as duplicate entries
+                updated_pool = (Pool.from_entries(pool_contents) - Pool.from_entries(cards_to_replace)
+                                + Pool.from_entries(pack_json))
+                updated_pool_id = await pool_to_sealeddeck(updated_pool.to_entries())
         except:
             print("sealeddeck issue — updating pool")
             # If something goes wrong with sealeddeck, highlight the pack cell red
-            await self.set_cell_to_red(curr_row, chr(ord('F') + loss_count))
+            await self.storage.mark_error(curr_row, chr(ord('F') + loss_count))
             return
 
         # record any extra cards we haven't yet
@@ -514,69 +709,31 @@ class PoolBot(discord.Client):
             except:
                 print("sealeddeck issue — updating pool")
                 # If something goes wrong with sealeddeck, highlight the pack cell red
-                await self.set_cell_to_red(curr_row, chr(ord('F') + loss_count))
+                await self.storage.mark_error(curr_row, chr(ord('F') + loss_count))
                 return
 
         # Write updated extra-card-included pool to spreadsheet
-        pool_body = {
-            'values': [
-                [f'https://sealeddeck.tech/{updated_pool_id}'],
-            ],
-        }
-        self.sheet.values().update(spreadsheetId=self.spreadsheet_id,
-                                   range=f'Pools!E{curr_row}:E{curr_row}', valueInputOption='USER_ENTERED',
-                                   body=pool_body).execute()
+        updates = [cell_update('E', curr_row, f'https://sealeddeck.tech/{updated_pool_id}')]
         if len(extra_cards) > extra_card_count:
-            self.sheet.values().update(spreadsheetId=self.spreadsheet_id,
-                                       range=f'Pools!AA{curr_row}:AA{curr_row}', valueInputOption='USER_ENTERED',
-                                       body={'values': [[len(extra_cards)]]}).execute()
+            updates.append(cell_update('AA', curr_row, len(extra_cards)))
+        await self.storage.write(updates)
 
         return
 
+    def pack_job_timed_out(self, job: PackJob):
+        self.run_in_background(self.league_committee_channel.send(
+            f"Only {len(job.packs)} of {job.expected} packs arrived for <@{job.owner_id}>'s `{job.description}` "
+            f"within {self.config.pack_job_timeout_minutes} minutes, so none of them were recorded. Please add the "
+            f"packs to their pool by hand. If the missing packs still show up, I'll link them here instead of "
+            f"recording them."
+        ))
+
     async def write_pack(self, new_pack_id: str, loss_count: int, curr_row: int):
-        pack_body = {
-            'values': [
-                [f'=HYPERLINK("https://sealeddeck.tech/{new_pack_id}", "Link")'],
-            ],
-        }
         # Find the proper column ID
         col = chr(ord('F') + loss_count)
-        self.sheet.values().update(spreadsheetId=self.spreadsheet_id,
-                                   range=f'Pools!{col}{curr_row}:{col}{curr_row}', valueInputOption='USER_ENTERED',
-                                   body=pack_body).execute()
-
-    async def set_cell_to_red(self, row: int, col: str):
-        # Note that this request (annoyingly) uses indices instead of the regular cell format.
-        color_body = {
-            'requests': [{
-                'updateCells': {
-                    'rows': [{
-                        'values': [{
-                            'userEnteredFormat': {
-                                'backgroundColorStyle': {
-                                    'rgbColor': {
-                                        "red": 1,
-                                        "green": 0,
-                                        "blue": 0,
-                                        "alpha": 1,
-                                    }
-                                }
-                            }
-                        }]
-                    }],
-                    'fields': 'userEnteredFormat',
-                    'range': {
-                        'sheetId': self.pools_tab_id,
-                        'startRowIndex': row - 1,
-                        'endRowIndex': row,
-                        'startColumnIndex': ord(col) - ord('A'),
-                        'endColumnIndex': ord(col) - ord('A') + 1,
-                    },
-                },
-            }],
-        }
-        self.sheet.batchUpdate(spreadsheetId=self.spreadsheet_id,
-                               body=color_body).execute()
+        await self.storage.write([
+            cell_update(col, curr_row, f'=HYPERLINK("https://sealeddeck.tech/{new_pack_id}", "Link")'),
+        ])
 
     async def prompt_user_pick(self, message: discord.Message):
         # # Ensure the user doesn't already have a pending pick to make
@@ -624,24 +781,91 @@ class PoolBot(discord.Client):
             self.awaiting_boosters_for_user = None
 
     async def issue_challenge(self, message: discord.Message):
-        if not self.pending_lfm_user_mention:
+        request = self.lfm_queue.challenge(message.author.id)
+        if request is None:
             await self.lfm_channel.send(
                 "Sorry, but no one is looking for a match right now. You can send out an anonymous LFM by DMing me "
                 "`!lfm`. "
             )
             return
 
+        # This has to be a new message rather than an edit so that the player gets pinged
         await self.lfm_channel.send(
-            f"{self.pending_lfm_user_mention}, your anonymous LFM has been accepted by {message.author.mention}.")
-
-        await update_message(
-            self.active_lfm_message,
-            f'~~{self.active_lfm_message.content}~~\n'
-            f'A match was found between {self.pending_lfm_user_mention} and {message.author.mention}.'
-        )
-
-        self.pending_lfm_user_mention = None
-        self.active_lfm_message = None
+            f"{request.user.mention}, your anonymous LFM has been accepted by {message.author.mention}.")
+        # The challenger has a match now, so they shouldn't be listed as looking for one
+        if self.lfm_queue.cancel(message.author.id):
+            self.run_in_background(message.author.send(
+                "You've found a match, so I've taken down your anonymous LFM."
+            ))
+        self.refresh_lfm_post()
+
+    def lfm_expired(self, request: LfmRequest):
+        self.run_in_background(request.user.send(
+            f"Your anonymous LFM expired after {self.config.lfm_expiry_minutes} minutes without a challenger. "
+            f"Send me `!lfm` again if you're still looking for a match."
+        ))
+        self.refresh_lfm_post()
+
+    def lfm_post_content(self) -> str:
+        if len(self.lfm_queue) == 0:
+            return "No one is looking for a match right now. You can send out an anonymous LFM by DMing me `!lfm`."
+        lines = [
+            f"{len(self.lfm_queue)} mysterious creature(s) looking for a match. Post `!challenge` to reveal the "
+            f"identity of the one who has waited longest and initiate a match."
+        ]
+        for request in itertools.islice(self.lfm_queue.requests.values(), LFM_POST_LISTED):
+            lines.append(f"> Waiting since <t:{int(request.created_at)}:R>" +
+                         (f": {request.note}" if request.note else ""))
+        if len(self.lfm_queue) > LFM_POST_LISTED:
+            lines.append(f"> ...and {len(self.lfm_queue) - LFM_POST_LISTED} more")
+        return '\n'.join(lines)[:2000]
+
+    def refresh_lfm_post(self):
+        """Schedule an update of the LFM post, batching together any other queue changes that happen meanwhile"""
+        self.lfm_post_dirty = True
+        if self.lfm_post_task is None or self.lfm_post_task.done():
+            self.lfm_post_task = asyncio.create_task(self.update_lfm_post())
+
+    async def update_lfm_post(self):
+        while self.lfm_post_dirty:
+            await asyncio.sleep(LFM_POST_DEBOUNCE_SECONDS)
+            self.lfm_post_dirty = False
+            content = self.lfm_post_content()
+            try:
+                if len(self.lfm_queue) == 0:
+                    if self.lfm_post:
+                        await update_message(self.lfm_post, content)
+                    self.lfm_post_idle = True
+                    continue
+                # Only repost when the queue comes back to life and the old post has been buried by chat
+                if self.lfm_post is None or (self.lfm_post_idle
+                                             and self.lfm_channel.last_message_id != self.lfm_post.id):
+                    if self.lfm_post:
+                        await self.lfm_post.delete()
+                    self.lfm_post = await self.lfm_channel.send(content)
+                else:
+                    await update_message(self.lfm_post, content)
+                self.lfm_post_idle = False
+            except discord.errors.HTTPException as e:
+                # Most likely the post was deleted by hand. Start a fresh one next time.
+                print(e)
+                self.lfm_post = None
+
+    async def find_pack_option(self, user: Union[discord.Member, discord.User], option: str) -> Optional[discord.Message]:
+        """Find the user's latest pending `Pack Option` post, scanning the channel only if the index isn't ready yet"""
+        record = self.pack_index.latest(self.packs_channel.id, user.id, f'option_{option.lower()}')
+        if record is not None:
+            try:
+                return await self.packs_channel.fetch_message(record.message_id)
+            except discord.errors.NotFound:
+                return None
+        if self.pack_index.backfilled(self.packs_channel.id):
+            return None
+        async for message in self.packs_channel.history(limit=500):
+            if (message.author.name == 'AGL Bot' and message.mentions and message.mentions[0] == user
+                    and f'Pack Option {option}' in message.content):
+                return message
+        return None
 
     async def choose_pack(self, user: Union[discord.Member, discord.User], chosen_option: str):
         if chosen_option == 'A':
@@ -652,19 +876,8 @@ class PoolBot(discord.Client):
             not_chosen_option = 'A'
             split = '!choosePackB`'
             not_chosen_split = '!choosePackA`'
-        chosen_message = None
-        async for message in self.packs_channel.history(limit=500):
-            if (message.author.name == 'AGL Bot' and message.mentions and message.mentions[0] == user
-                    and f'Pack Option {chosen_option}' in message.content):
-                chosen_message = message
-                break
-
-        not_chosen_message = None
-        async for message in self.packs_channel.history(limit=500):
-            if (message.author.name == 'AGL Bot' and message.mentions and message.mentions[0] == user
-                    and f'Pack Option {not_chosen_option}' in message.content):
-                not_chosen_message = message
-                break
+        chosen_message = await self.find_pack_option(user, chosen_option)
+        not_chosen_message = await self.find_pack_option(user, not_chosen_option)
 
         if not chosen_message or not not_chosen_message:
             await user.send(
@@ -679,6 +892,9 @@ class PoolBot(discord.Client):
         not_chosen_message = await update_message(not_chosen_message,
                                                   f'Pack not chosen by {user.mention}.'
                                                   f'~~{not_chosen_message.content.split(not_chosen_split)[1]}~~')
+        # Edits to uncached messages don't reach on_message_edit, so index these directly
+        self.index_pack(chosen_message)
+        self.index_pack(not_chosen_message)
 
         await user.send("Understood. Your selection has been noted.")
 
@@ -696,39 +912,26 @@ class PoolBot(discord.Client):
             return
 
         if command == '!lfm':
-            if self.pending_lfm_user_mention:
+            if message.author.id in self.lfm_queue:
                 await message.author.send(
-                    "Someone is already looking for a match. You can play them by posting !challenge in the "
-                    "looking-for-matches channel of the league discord. "
+                    "You already have an anonymous LFM out. If you want to cancel it, send me a message with the "
+                    "text `!nvm`."
                 )
                 return
-            if not argument:
-                self.active_lfm_message = await self.lfm_channel.send(
-                    "A mysterious creature is looking for a match. Post `!challenge` to reveal their identity and "
-                    "initiate a match. "
-                )
-            else:
-                self.active_lfm_message = await self.lfm_channel.send(
-                    f"A mysterious creature is looking for a match. Post `!challenge` to reveal their identity and "
-                    f"initiate a match.\n "
-                    f"Message from the player:\n"
-                    f"> {argument}"
-                )
+            self.lfm_queue.enqueue(message.author, argument)
+            self.refresh_lfm_post()
             await message.author.send(
-                f"I've created a post for you. You'll receive a mention when an opponent is found.\n"
+                f"I've added you to the looking-for-match post. You'll receive a mention when an opponent is found.\n"
                 f"If you want to cancel this, send me a message with the text `!nvm`."
             )
-            self.pending_lfm_user_mention = message.author.mention
             return
 
         if command == '!retractlfm' or command == '!nvm':
-            if message.author.mention == self.pending_lfm_user_mention:
-                await self.active_lfm_message.delete()
-                self.active_lfm_message = None
+            if self.lfm_queue.cancel(message.author.id):
+                self.refresh_lfm_post()
                 await message.author.send(
-                    "Understood. The post made on your behalf has been deleted."
+                    "Understood. Your anonymous LFM has been removed."
                 )
-                self.pending_lfm_user_mention = None
             else:
                 await message.author.send(
                     "You don't currently have an outgoing LFM."
@@ -769,6 +972,13 @@ class PoolBot(discord.Client):
             new_id = await pool_to_sealeddeck(
                 pack_json, sealeddeck_id
             )
+        except CircuitOpenError as e:
+            print(f"Sealeddeck error: {e}")
+            content = (
+                f"{message.author.mention}\n"
+                f"sealeddeck.tech is having some issues right now, "
+                f"so the packs were not added. Try again in a few minutes."
+            )
         except aiohttp.ClientResponseError as e:
             print(f"Sealeddeck error: {e}")
             content = (
@@ -779,7 +989,14 @@ class PoolBot(discord.Client):
                 f"If the ID is correct, sealeddeck.tech might be "
                 f"having some issues right now, try again later."
             )
-
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            print(f"Sealeddeck error: {e!r}")
+            content = (
+                f"{message.author.mention}\n"
+                f"sealeddeck.tech didn't answer in time, so I couldn't "
+                f"confirm the packs were added. Check the pool with ID "
+                f"`{sealeddeck_id}` before trying again."
+            )
         else:
             content = (
                 f"{message.author.mention}\n"
@@ -828,36 +1045,3 @@ class PoolBot(discord.Client):
                     print('DMed ' + member.display_name)
                     count += 1
         await sender.send(f'Successfully DMed {count} user(s).')
-
-    async def get_spreadsheet_values(self, range: str, valueRenderOption="FORMATTED_VALUE"):
-        creds = None
-        # The file token.json stores the user's access and refresh tokens, and is
-        # created automatically when the authorization flow completes for the first
-        # time.
-        if os.path.exists('token.json'):
-            creds = Credentials.from_authorized_user_file('token.json',
-                                                          ['https://www.googleapis.com/auth/spreadsheets'])
-        # If there are no (valid) credentials available, let the user log in.
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials.json', ['https://www.googleapis.com/auth/spreadsheets'])
-                creds = flow.run_local_server(port=0)
-            # Save the credentials for the next run
-            with open('token.json', 'w') as token:
-                token.write(creds.to_json())
-
-        try:
-            service = build('sheets', 'v4', credentials=creds)
-
-            # Call the Sheets API
-            self.sheet = service.spreadsheets()
-            result = self.sheet.values().get(spreadsheetId=self.spreadsheet_id,
-                                             range=range,
-                                             valueRenderOption=valueRenderOption).execute()
-            return result.get('values', [])
-        except HttpError as err:
-            print(err)
-        return []
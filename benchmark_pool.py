@@ -0,0 +1,98 @@
+"""
+Compares the interned Pool type against the list-of-dicts + Counter approach for league-sized pool math, timing the
+same entries-in, entries-out paths PoolBot runs.
+
+    python benchmark_pool.py
+"""
+import random
+import timeit
+import tracemalloc
+from collections import Counter
+from typing import Sequence
+
+from pool import Pool, SealedDeckEntry
+
+PLAYERS = 190
+POOL_SIZE = 6 * 15 + 11 * 14
+CARD_POOL = 2000
+
+
+def dict_remove_cards(pool: Sequence[SealedDeckEntry], cards_to_remove: Sequence[SealedDeckEntry]) -> Sequence[SealedDeckEntry]:
+    # The pre-Pool implementation of remove_cards
+    counted: Counter[str] = Counter()
+    for card in pool:
+        counted[card["name"]] += card["count"]
+    for card in cards_to_remove:
+        counted[card["name"]] -= card["count"]
+    return [{"name": name, "count": count} for name, count in counted.items() if count > 0]
+
+
+def dict_same_pool(pool: Sequence[SealedDeckEntry], other: Sequence[SealedDeckEntry]) -> bool:
+    def counted(entries: Sequence[SealedDeckEntry]) -> Counter[str]:
+        totals: Counter[str] = Counter()
+        for card in entries:
+            totals[card["name"]] += card["count"]
+        return totals
+    return counted(pool) == counted(other)
+
+
+def pool_remove_cards(pool: Sequence[SealedDeckEntry], cards_to_remove: Sequence[SealedDeckEntry]) -> Sequence[SealedDeckEntry]:
+    # PoolBot.remove_cards
+    return (Pool.from_entries(pool) - Pool.from_entries(cards_to_remove)).to_entries()
+
+
+def pool_replace_pack(pool: Sequence[SealedDeckEntry], old_pack: Sequence[SealedDeckEntry],
+                      new_pack: Sequence[SealedDeckEntry]) -> Sequence[SealedDeckEntry]:
+    # Pack replacement in track_pack
+    return (Pool.from_entries(pool) - Pool.from_entries(old_pack) + Pool.from_entries(new_pack)).to_entries()
+
+
+def random_entries(rng: random.Random, size: int) -> Sequence[SealedDeckEntry]:
+    return [{"name": f"Card Name Number {rng.randrange(CARD_POOL)}", "count": 1} for _ in range(size)]
+
+
+def measure_memory(build) -> int:
+    tracemalloc.start()
+    kept = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current
+
+
+def main():
+    rng = random.Random(0)
+    league = [random_entries(rng, POOL_SIZE) for _ in range(PLAYERS)]
+    old_packs = [random_entries(rng, 14) for _ in range(PLAYERS)]
+    new_packs = [random_entries(rng, 14) for _ in range(PLAYERS)]
+    copies = [list(entries) for entries in league]
+
+    # Memory of a league's worth of pools, built from card names that live outside the measured structures
+    dict_bytes = measure_memory(lambda: [dict_remove_cards(entries, []) for entries in league])
+    pool_bytes = measure_memory(lambda: [Pool.from_entries(entries) for entries in league])
+    print(f"memory, {PLAYERS} pools: dict-list {dict_bytes / 1024:.0f} KiB, Pool {pool_bytes / 1024:.0f} KiB")
+
+    # Every call site starts from sealeddeck.tech entries and (apart from comparison) ends with entries to post, so
+    # both sides are timed entries in, entries out, conversions included
+    runs = 20
+
+    def report(name: str, dict_run, pool_run):
+        dict_time = timeit.timeit(dict_run, number=runs) / runs
+        pool_time = timeit.timeit(pool_run, number=runs) / runs
+        print(f"{name}: dict-list {dict_time * 1000:.2f} ms, Pool {pool_time * 1000:.2f} ms "
+              f"({dict_time / pool_time:.1f}x)")
+
+    report("remove_cards across league",
+           lambda: [dict_remove_cards(pool, pack) for pool, pack in zip(league, old_packs)],
+           lambda: [pool_remove_cards(pool, pack) for pool, pack in zip(league, old_packs)])
+    # The pre-Pool track_pack concatenated the new pack onto the remaining cards without merging
+    report("replace pack across league",
+           lambda: [[*dict_remove_cards(pool, old), *new] for pool, old, new in zip(league, old_packs, new_packs)],
+           lambda: [pool_replace_pack(pool, old, new) for pool, old, new in zip(league, old_packs, new_packs)])
+    report("compare pools across league",
+           lambda: [dict_same_pool(pool, other) for pool, other in zip(league, copies)],
+           lambda: [Pool.from_entries(pool) == Pool.from_entries(other) for pool, other in zip(league, copies)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import json
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Union
+
+import discord
+
+# Attribute names on PoolBot for the channels a trace cares about, so a replay can wire the same roles back up
+CHANNEL_ROLES = ['pool_channel', 'packs_channel', 'lfm_channel', 'bot_bunker_channel', 'league_committee_channel']
+# DM commands that make or withdraw an anonymous LFM, whose authors are pseudonymized in traces
+LFM_COMMANDS = ['!lfm', '!retractlfm', '!nvm']
+
+
+def serialize_user(user: Union[discord.Member, discord.User], bot: discord.Client) -> dict:
+    role = None
+    if user == bot.booster_tutor:
+        role = 'booster_tutor'
+    elif user == bot.user:
+        role = 'self'
+    return {
+        "id": user.id,
+        "name": user.name,
+        "display_name": user.display_name,
+        "bot": user.bot,
+        "role": role,
+    }
+
+
+def serialize_message(message: discord.Message, bot: discord.Client) -> dict:
+    role = None
+    for channel_role in CHANNEL_ROLES:
+        if message.channel == getattr(bot, channel_role):
+            role = channel_role
+    return {
+        "id": message.id,
+        "content": message.content,
+        "author": serialize_user(message.author, bot),
+        "mentions": [serialize_user(user, bot) for user in message.mentions],
+        "channel": {"id": message.channel.id, "role": role},
+        "dm": message.guild is None,
+        "reference": message.reference.message_id if message.reference else None,
+    }
+
+
+class TraceRecorder:
+    """
+    Records the inputs of on_message and on_message_edit to a JSONL trace that replay.py can play back. Events are
+    buffered and written every `flush_seconds` on a background thread, so recording doesn't block the event loop.
+
+    Anonymous LFM DMs are recorded under a pseudonym rather than their real author. The pseudonym is derived with a
+    salt that only lives as long as the recorder, so it stays consistent within a trace (a replayed `!lfm` and `!nvm`
+    still come from the same user) but can't be matched back to a Discord id by hashing known ids.
+    """
+
+    def __init__(self, path: str, flush_seconds: float = 1.0):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.salt = secrets.token_bytes(16)
+        self.buffer: List[dict] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        # A single thread, so flushes reach the file in order
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='trace-writer')
+
+    def record(self, bot: discord.Client, event: str, message: discord.Message,
+               before: Optional[discord.Message] = None):
+        record = {"at": time.time(), "event": event, "message": self.redact(serialize_message(message, bot))}
+        if before is not None:
+            record["before"] = self.redact(serialize_message(before, bot))
+        self.buffer.append(record)
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.flush_seconds, self.flush)
+
+    def redact(self, data: dict) -> dict:
+        command = data["content"].split(None, 1)[0].lower() if data["content"].strip() else ''
+        if not data["dm"] or command not in LFM_COMMANDS:
+            return data
+        digest = hashlib.sha256(self.salt + str(data["author"]["id"]).encode()).hexdigest()
+        pseudonym = f"anonymous-{digest[:8]}"
+        data["author"] = {**data["author"], "id": int(digest[:15], 16), "name": pseudonym, "display_name": pseudonym}
+        return data
+
+    def flush(self):
+        """Hand the buffered events to the writer thread"""
+        self.flush_handle = None
+        records, self.buffer = self.buffer, []
+        if records:
+            self.writer.submit(self._write, records)
+
+    def _write(self, records: List[dict]):
+        try:
+            with open(self.path, 'a') as file:
+                file.write(''.join(json.dumps(record) + "\n" for record in records))
+        except OSError as e:
+            print(f"couldn't write event trace: {e}")
@@ -0,0 +1,165 @@
+import json
+import os.path
+from collections import Counter
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Optional, List, Sequence
+
+from storage import FIRST_ROW, NAME_INDEX, LOSSES_INDEX, cell_int, cell_update, column_index
+
+# (balance column, spent column) for each spendable resource on the Pools tab
+RESOURCE_COLUMNS = {
+    "clue": ("Q", "R"),
+    "map": ("R", "Q"),
+}
+
+
+@dataclass(frozen=True)
+class SpendEvent:
+    seq: int
+    player: str
+    row: int
+    resource: str
+    amount: int
+    command: str
+    timestamp: str
+
+
+@dataclass
+class PlayerSnapshot:
+    name: str
+    row: int
+    losses: int
+    # Resource balances as of the last spreadsheet read, less anything synced since
+    balances: dict[str, int]
+
+
+class Ledger:
+    """
+    Append-only log of clue and map spends. Spends are recorded locally first, and the spreadsheet totals are
+    brought up to date in batches: `pending_updates` builds the writes, `record_write` logs them before they're sent,
+    and `mark_synced` settles the spends once the sheet has them. Until then they still count against balances.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.events: List[SpendEvent] = []
+        self.synced_through = 0
+        # Writes logged by record_write that haven't been confirmed by mark_synced yet. They hold absolute totals, so
+        # sending them again is harmless.
+        self.unconfirmed_through = 0
+        self.unconfirmed_writes: List[dict] = []
+        self.players: dict[str, PlayerSnapshot] = dict()
+        self.unsynced: Counter[tuple[str, str]] = Counter()
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        self._apply(json.loads(line))
+
+    def _apply(self, record: dict):
+        if record["type"] == "spend":
+            event = SpendEvent(**{k: v for k, v in record.items() if k != "type"})
+            self.events.append(event)
+            self.unsynced[(event.player, event.resource)] += event.amount
+        elif record["type"] == "write":
+            self.unconfirmed_through = record["through"]
+            self.unconfirmed_writes.extend(record["data"])
+        elif record["type"] == "sync":
+            self._settle(record["through"])
+            if self.synced_through >= self.unconfirmed_through:
+                self.unconfirmed_writes = []
+
+    def _append(self, record: dict):
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(record) + "\n")
+        self._apply(record)
+
+    def _settle(self, through: int):
+        """Move events up to `through` out of the unsynced totals and into the snapshot balances"""
+        for event in self.events:
+            if self.synced_through < event.seq <= through:
+                self.unsynced[(event.player, event.resource)] -= event.amount
+                player = self.players.get(event.player)
+                if player:
+                    player.balances[event.resource] -= event.amount
+        self.synced_through = max(self.synced_through, through)
+
+    @property
+    def last_seq(self) -> int:
+        return self.events[-1].seq if self.events else 0
+
+    def load_snapshot(self, spreadsheet_values: Sequence[Sequence[str]]):
+        """Replace the cached player rows with a fresh read of Pools!B7:AA200"""
+        players = dict()
+        for offset, row in enumerate(spreadsheet_values):
+            if len(row) < 5 or row[NAME_INDEX] == '':
+                continue
+            name = row[NAME_INDEX].lower()
+            players[name] = PlayerSnapshot(
+                name=name,
+                row=FIRST_ROW + offset,
+                losses=cell_int(row, LOSSES_INDEX),
+                balances={resource: cell_int(row, column_index(balance_col))
+                          for resource, (balance_col, _) in RESOURCE_COLUMNS.items()},
+            )
+        self.players = players
+
+    def find_player(self, display_name: str) -> Optional[PlayerSnapshot]:
+        for name, player in self.players.items():
+            if name in display_name.lower():
+                return player
+        return None
+
+    def balance(self, player: PlayerSnapshot, resource: str) -> int:
+        return player.balances[resource] - self.unsynced[(player.name, resource)]
+
+    def record(self, player: PlayerSnapshot, resource: str, amount: int, command: str) -> SpendEvent:
+        event = SpendEvent(
+            seq=self.last_seq + 1,
+            player=player.name,
+            row=player.row,
+            resource=resource,
+            amount=amount,
+            command=command,
+            timestamp=datetime.now().isoformat(),
+        )
+        self._append({"type": "spend", **asdict(event)})
+        return event
+
+    def pending_updates(self, spreadsheet_values: Sequence[Sequence[str]]) -> tuple[int, List[dict]]:
+        """
+        Build the storage writes needed to push unsynced spends to the sheet, based on a read taken right before.
+        Spends already covered by an unconfirmed write are left out, since the read includes them.
+        Returns the last sequence number covered along with the value ranges to write.
+        """
+        through = self.last_seq
+        already_written = max(self.synced_through, self.unconfirmed_through)
+        totals: Counter[tuple[int, str]] = Counter()
+        for event in self.events:
+            if already_written < event.seq <= through:
+                totals[(event.row, event.resource)] += event.amount
+
+        data = []
+        for (row, resource), amount in totals.items():
+            if amount == 0 or row - FIRST_ROW >= len(spreadsheet_values):
+                continue
+            spent_col = RESOURCE_COLUMNS[resource][1]
+            spent = cell_int(spreadsheet_values[row - FIRST_ROW], column_index(spent_col))
+            data.append(cell_update(spent_col, row, spent + amount))
+        return through, data
+
+    def record_write(self, through: int, data: List[dict]):
+        """Log writes from `pending_updates` before sending them, so a failed or interrupted sync can resend them"""
+        self._append({"type": "write", "through": through, "data": data})
+
+    def mark_synced(self, through: int):
+        if through > self.synced_through:
+            self._append({"type": "sync", "through": through})
+
+    def spent_totals(self) -> Counter[tuple[str, str]]:
+        """Total spends per (player, resource) across the whole ledger"""
+        totals: Counter[tuple[str, str]] = Counter()
+        for event in self.events:
+            totals[(event.player, event.resource)] += event.amount
+        return totals
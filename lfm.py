@@ -0,0 +1,57 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
+
+import discord
+
+
+@dataclass
+class LfmRequest:
+    user: Union[discord.Member, discord.User]
+    note: str
+    created_at: float = field(default_factory=time.time)
+    expiry: Optional[asyncio.TimerHandle] = None
+
+
+class LfmQueue:
+    """
+    Anonymous looking-for-match requests, oldest first. Each user can have one request at a time, and requests are
+    dropped automatically after `expiry_seconds`, calling `on_expire` with the expired request.
+    """
+
+    def __init__(self, expiry_seconds: float, on_expire: Callable[[LfmRequest], None]):
+        self.expiry_seconds = expiry_seconds
+        self.on_expire = on_expire
+        self.requests: OrderedDict[int, LfmRequest] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.requests
+
+    def enqueue(self, user: Union[discord.Member, discord.User], note: str) -> LfmRequest:
+        request = LfmRequest(user, note)
+        request.expiry = asyncio.get_running_loop().call_later(self.expiry_seconds, self._expire, user.id)
+        self.requests[user.id] = request
+        return request
+
+    def cancel(self, user_id: int) -> Optional[LfmRequest]:
+        request = self.requests.pop(user_id, None)
+        if request and request.expiry:
+            request.expiry.cancel()
+        return request
+
+    def challenge(self, challenger_id: int) -> Optional[LfmRequest]:
+        """Take the longest-waiting request that isn't the challenger's own"""
+        for user_id in self.requests:
+            if user_id != challenger_id:
+                return self.cancel(user_id)
+        return None
+
+    def _expire(self, user_id: int):
+        request = self.requests.pop(user_id, None)
+        if request:
+            self.on_expire(request)
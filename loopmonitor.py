@@ -0,0 +1,85 @@
+import asyncio
+import bisect
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+# Upper bounds, in seconds, of the scheduling delay histogram buckets. The final bucket catches everything else.
+LAG_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop runs a periodic heartbeat, and watches for stalls from a separate thread. When the
+    loop has been stuck for longer than `threshold` seconds, the watchdog logs the stack of whatever is blocking it,
+    along with the name of the task that was running (see `label_current_task`).
+    """
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.05):
+        self.threshold = threshold
+        self.interval = interval
+        self.histogram = [0] * (len(LAG_BUCKETS) + 1)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_beat = time.monotonic()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.heartbeat_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start monitoring the running event loop. Must be called from the loop's thread."""
+        if self.heartbeat_task is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        threading.Thread(target=self.watchdog, name='loop-watchdog', daemon=True).start()
+
+    @staticmethod
+    def label_current_task(label: str):
+        """Name the running task, so stall reports can say which command was responsible"""
+        task = asyncio.current_task()
+        if task is not None:
+            task.set_name(label)
+
+    def record_lag(self, lag: float):
+        self.histogram[bisect.bisect_left(LAG_BUCKETS, lag)] += 1
+        self.max_lag = max(self.max_lag, lag)
+
+    async def heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_beat = now
+            self.record_lag(max(0.0, now - expected))
+
+    def watchdog(self):
+        reported_beat = None
+        while True:
+            time.sleep(self.interval)
+            beat = self.last_beat
+            if time.monotonic() - beat < self.threshold or beat == reported_beat:
+                continue
+            # Only report each stall once, however long it lasts
+            reported_beat = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self.loop_thread_id)
+            task = asyncio.current_task(self.loop)
+            stack = ''.join(traceback.format_stack(frame)) if frame else '(no frame)\n'
+            print(f"event loop stalled for over {self.threshold}s in "
+                  f"{task.get_name() if task else 'loop callbacks'}:\n{stack}", end='')
+
+    def summary(self) -> str:
+        total = sum(self.histogram)
+        lines = [f'{total} heartbeats, {self.stalls} stall(s) over {self.threshold}s, worst lag {self.max_lag:.3f}s']
+        lower = 0.0
+        for upper, count in zip([*LAG_BUCKETS, None], self.histogram):
+            if count:
+                bucket = f'{lower * 1000:g}-{upper * 1000:g}ms' if upper else f'>{lower * 1000:g}ms'
+                lines.append(f'> {bucket}: {count}')
+            lower = upper
+        return '\n'.join(lines)
@@ -0,0 +1,184 @@
+import re
+import sqlite3
+from dataclasses import dataclass
+from typing import Callable, Optional, List, Union
+
+import discord
+
+# Messages fetched per page while backfilling, the most Discord returns per request
+PAGE_SIZE = 100
+
+
+@dataclass(frozen=True)
+class PackRecord:
+    message_id: int
+    channel_id: int
+    guild_id: Optional[int]
+    owner_id: int
+    # 'pack' or 'pool' for Booster Tutor posts, 'option_a'/'option_b'/'chosen'/'not_chosen' for !playerchoice posts
+    kind: str
+    set_command: Optional[str]
+    pack: str
+    created_at: str
+
+    @property
+    def jump_url(self) -> str:
+        return f'https://discord.com/channels/{self.guild_id}/{self.channel_id}/{self.message_id}'
+
+
+def set_command(content: str) -> Optional[str]:
+    """The command a Booster Tutor pack was generated with (like `!lci`), from the text before its code fence"""
+    command_match = re.search("![\\w|-]+", content.split("```")[0])
+    return command_match and command_match.group(0).lower()
+
+
+def pack_record(message: discord.Message, booster_tutor: Optional[Union[discord.Member, discord.User]],
+                bot_user: Union[discord.Member, discord.User], pool_channel: discord.TextChannel) -> Optional[PackRecord]:
+    """Pull the pack out of a Booster Tutor or PoolBot message, or return None if it doesn't contain one"""
+    if "```" not in message.content or not message.mentions:
+        return None
+    header = message.content.split("```")[0]
+    command = None
+    if booster_tutor is not None and message.author == booster_tutor:
+        kind = 'pool' if message.channel == pool_channel else 'pack'
+        # Like track_pack, treat the last mention as the pack's owner
+        owner = message.mentions[-1]
+        command = set_command(message.content)
+    elif message.author == bot_user:
+        if header.startswith('Pack Option A'):
+            kind = 'option_a'
+        elif header.startswith('Pack Option B'):
+            kind = 'option_b'
+        elif header.startswith('Pack chosen'):
+            kind = 'chosen'
+        elif header.startswith('Pack not chosen'):
+            kind = 'not_chosen'
+        else:
+            return None
+        owner = message.mentions[0]
+    else:
+        return None
+    return PackRecord(
+        message_id=message.id,
+        channel_id=message.channel.id,
+        guild_id=message.guild.id if message.guild else None,
+        owner_id=owner.id,
+        kind=kind,
+        set_command=command,
+        pack=message.content.split("```")[1].strip(),
+        created_at=message.created_at.isoformat(),
+    )
+
+
+class PackIndex:
+    """
+    SQLite index of every pack posted in the packs and pool channels. `backfill` pages through channel history once,
+    checkpointing as it goes so an interrupted backfill picks up where it left off, and `add` keeps it current from
+    live message and edit events.
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        # Channels whose backfill is running. Their checkpoints are only moved by the backfill itself.
+        self.backfilling: set[int] = set()
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS packs (
+                message_id INTEGER PRIMARY KEY,
+                channel_id INTEGER NOT NULL,
+                guild_id INTEGER,
+                owner_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                set_command TEXT,
+                pack TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS packs_by_owner ON packs (owner_id, channel_id, kind);
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                channel_id INTEGER PRIMARY KEY,
+                oldest_id INTEGER,
+                newest_id INTEGER,
+                complete INTEGER NOT NULL DEFAULT 0
+            );
+        ''')
+
+    def _insert(self, records: List[PackRecord]):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO packs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(r.message_id, r.channel_id, r.guild_id, r.owner_id, r.kind, r.set_command, r.pack, r.created_at)
+             for r in records])
+
+    def add(self, record: PackRecord):
+        with self.db:
+            self._insert([record])
+
+    def _checkpoint(self, channel_id: int) -> tuple[Optional[int], Optional[int], bool]:
+        row = self.db.execute('SELECT oldest_id, newest_id, complete FROM checkpoints WHERE channel_id = ?',
+                              (channel_id,)).fetchone()
+        return (row[0], row[1], bool(row[2])) if row else (None, None, False)
+
+    def _save_checkpoint(self, channel_id: int, oldest_id: Optional[int], newest_id: Optional[int], complete: bool):
+        self.db.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)',
+                        (channel_id, oldest_id, newest_id, int(complete)))
+
+    async def backfill(self, channel: discord.TextChannel,
+                       extract: Callable[[discord.Message], Optional[PackRecord]]):
+        """
+        Index a channel's history. Walks backwards from the oldest message seen so far until the start of the channel,
+        then forwards from the newest message seen to catch anything posted while the bot was offline.
+        """
+        async def index_page(**history_kwargs) -> tuple[List[discord.Message], List[PackRecord]]:
+            page = [message async for message in channel.history(limit=PAGE_SIZE, **history_kwargs)]
+            return page, [record for record in map(extract, page) if record is not None]
+
+        oldest_id, newest_id, complete = self._checkpoint(channel.id)
+        self.backfilling.add(channel.id)
+        try:
+            while not complete:
+                before = discord.Object(id=oldest_id) if oldest_id else None
+                page, records = await index_page(before=before)
+                if page:
+                    oldest_id = min(message.id for message in page)
+                    newest_id = max([message.id for message in page] + ([newest_id] if newest_id else []))
+                complete = len(page) < PAGE_SIZE
+                with self.db:
+                    self._insert(records)
+                    self._save_checkpoint(channel.id, oldest_id, newest_id, complete)
+
+            while newest_id:
+                page, records = await index_page(after=discord.Object(id=newest_id), oldest_first=True)
+                if not page:
+                    break
+                newest_id = max(message.id for message in page)
+                with self.db:
+                    self._insert(records)
+                    self._save_checkpoint(channel.id, oldest_id, newest_id, complete)
+        finally:
+            self.backfilling.discard(channel.id)
+
+    def backfilled(self, channel_id: int) -> bool:
+        return self._checkpoint(channel_id)[2]
+
+    def note_newest(self, channel_id: int, message_id: int):
+        """
+        Advance a channel's checkpoint past a live message, once its backfill has finished. While the backfill is
+        catching up after a restart, moving the checkpoint past messages it hasn't reached yet would leave a gap if the
+        bot stopped before the catch-up finished, so the backfill saves the newest message itself.
+        """
+        if channel_id in self.backfilling:
+            return
+        oldest_id, newest_id, complete = self._checkpoint(channel_id)
+        if complete and (newest_id is None or message_id > newest_id):
+            with self.db:
+                self._save_checkpoint(channel_id, oldest_id, message_id, complete)
+
+    def _records(self, query: str, params: tuple) -> List[PackRecord]:
+        return [PackRecord(*row) for row in self.db.execute(query, params).fetchall()]
+
+    def latest(self, channel_id: int, owner_id: int, kind: str) -> Optional[PackRecord]:
+        records = self._records('SELECT * FROM packs WHERE channel_id = ? AND owner_id = ? AND kind = ? '
+                                'ORDER BY message_id DESC LIMIT 1', (channel_id, owner_id, kind))
+        return records[0] if records else None
+
+    def packs_for(self, owner_id: int, limit: int = 20) -> List[PackRecord]:
+        return self._records('SELECT * FROM packs WHERE owner_id = ? ORDER BY message_id DESC LIMIT ?',
+                             (owner_id, limit))
@@ -0,0 +1,123 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional, List, Sequence
+
+from pool import Pool, SealedDeckEntry
+
+
+@dataclass
+class PackJob:
+    """A reward made of several Booster Tutor packs that should be recorded as one pack"""
+    owner_id: int
+    # The set command each pack is generated with, like `!lci`. Commands are removed as their packs arrive.
+    waiting_for: List[str]
+    description: str
+    packs: List[Sequence[SealedDeckEntry]] = field(default_factory=list)
+    timeout: Optional[asyncio.TimerHandle] = None
+    # Set once the job has timed out. Packs that still arrive for it are late, and shouldn't be recorded.
+    expired: bool = False
+
+    @property
+    def expected(self) -> int:
+        return len(self.packs) + len(self.waiting_for)
+
+    @property
+    def complete(self) -> bool:
+        return not self.waiting_for
+
+    def cards(self) -> Sequence[SealedDeckEntry]:
+        combined = Pool()
+        for pack in self.packs:
+            combined += Pool.from_entries(pack)
+        return combined.to_entries()
+
+
+@dataclass
+class SentCommand:
+    """A pack command PoolBot posted for Booster Tutor, whose pack hasn't arrived yet"""
+    owner_id: int
+    command: str
+    # None until the post goes through
+    message_id: Optional[int] = None
+    job: Optional[PackJob] = None
+    sent_at: float = field(default_factory=time.monotonic)
+
+
+class PackJobs:
+    """
+    Pending multi-pack rewards, one per player. Every pack command PoolBot posts is noted with `sent`, so each
+    Booster Tutor pack can be matched to the command it answers: the one it replies to, or else the oldest unanswered
+    command for the same player and set. Only packs answering a job's own commands are taken into it, in any order.
+
+    A job that hasn't received all of its packs within `timeout_seconds` is dropped and passed to `on_timeout`. Its
+    commands are remembered for as long again, so a pack that arrives late is recognised rather than recorded.
+    """
+
+    def __init__(self, timeout_seconds: float, on_timeout: Callable[[PackJob], None]):
+        self.timeout_seconds = timeout_seconds
+        self.on_timeout = on_timeout
+        self.jobs: dict[int, PackJob] = dict()
+        self.sent_commands: List[SentCommand] = []
+
+    def __contains__(self, owner_id: int) -> bool:
+        return owner_id in self.jobs
+
+    def start(self, owner_id: int, commands: Sequence[str], description: str) -> PackJob:
+        job = PackJob(owner_id, [command.lower() for command in commands], description)
+        job.timeout = asyncio.get_running_loop().call_later(self.timeout_seconds, self._expire, owner_id)
+        self.jobs[owner_id] = job
+        return job
+
+    def sent(self, owner_id: int, command: str, job: Optional[PackJob] = None) -> SentCommand:
+        """
+        Note a pack command about to be posted. Call this before posting, so the pack can't arrive first, and fill in
+        the returned command's `message_id` once the post goes through.
+        """
+        self._forget_old()
+        sent_command = SentCommand(owner_id, command.lower(), job=job)
+        self.sent_commands.append(sent_command)
+        return sent_command
+
+    def add(self, owner_id: int, command: Optional[str], reply_to: Optional[int],
+            pack: Sequence[SealedDeckEntry]) -> Optional[PackJob]:
+        """
+        Match a pack to the command it answers. Returns the job the pack belongs to, or None if it isn't part of one.
+        Finished jobs are removed and returned complete, and packs for a job that has timed out return it expired.
+        """
+        self._forget_old()
+        sent_command = self._match(owner_id, command, reply_to)
+        if sent_command is None:
+            return None
+        self.sent_commands.remove(sent_command)
+        job = sent_command.job
+        if job is None or job.expired:
+            return job
+        job.waiting_for.remove(sent_command.command)
+        job.packs.append(pack)
+        if job.complete:
+            job.timeout.cancel()
+            del self.jobs[job.owner_id]
+        return job
+
+    def _match(self, owner_id: int, command: Optional[str], reply_to: Optional[int]) -> Optional[SentCommand]:
+        if reply_to is not None:
+            for sent_command in self.sent_commands:
+                if sent_command.message_id == reply_to:
+                    return sent_command
+        if command is None:
+            return None
+        for sent_command in self.sent_commands:
+            if sent_command.owner_id == owner_id and sent_command.command == command.lower():
+                return sent_command
+        return None
+
+    def _forget_old(self):
+        cutoff = time.monotonic() - 2 * self.timeout_seconds
+        self.sent_commands = [sent_command for sent_command in self.sent_commands if sent_command.sent_at >= cutoff]
+
+    def _expire(self, owner_id: int):
+        job = self.jobs.pop(owner_id, None)
+        if job:
+            job.expired = True
+            self.on_timeout(job)
@@ -0,0 +1,93 @@
+from typing import Iterable, Iterator, List, Sequence, TypedDict
+
+
+class SealedDeckEntry(TypedDict):
+    name: str
+    count: int
+
+
+# Card names are interned to small integer ids shared by every pool, so a league's worth of pools only stores each
+# name once.
+_card_names: List[str] = []
+_card_ids: dict[str, int] = dict()
+
+
+def card_id(name: str) -> int:
+    id = _card_ids.get(name)
+    if id is None:
+        id = len(_card_names)
+        _card_names.append(name)
+        _card_ids[name] = id
+    return id
+
+
+def card_name(id: int) -> str:
+    return _card_names[id]
+
+
+class Pool:
+    """A multiset of cards, stored as interned card id -> count. Only positive counts are kept."""
+    __slots__ = ('counts',)
+
+    def __init__(self, counts: dict[int, int] = None):
+        self.counts: dict[int, int] = counts if counts is not None else dict()
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[SealedDeckEntry]) -> 'Pool':
+        """Build a pool from sealeddeck-style entries, merging any duplicate names"""
+        # This runs for every pool fetched from sealeddeck.tech, so look names up in the intern table directly
+        counts: dict[int, int] = dict()
+        card_ids = _card_ids
+        for entry in entries:
+            name = entry["name"]
+            id = card_ids.get(name)
+            if id is None:
+                id = card_id(name)
+            counts[id] = counts.get(id, 0) + entry["count"]
+        if all(count > 0 for count in counts.values()):
+            return cls(counts)
+        return cls({id: count for id, count in counts.items() if count > 0})
+
+    def to_entries(self) -> Sequence[SealedDeckEntry]:
+        return [{"name": _card_names[id], "count": count} for id, count in self.counts.items()]
+
+    def __add__(self, other: 'Pool') -> 'Pool':
+        counts = self.counts.copy()
+        for id, count in other.counts.items():
+            counts[id] = counts.get(id, 0) + count
+        return Pool(counts)
+
+    def __sub__(self, other: 'Pool') -> 'Pool':
+        """Remove the other pool's cards, decrementing counts or totally removing entries"""
+        counts = self.counts.copy()
+        for id, count in other.counts.items():
+            remaining = counts.get(id, 0) - count
+            if remaining > 0:
+                counts[id] = remaining
+            else:
+                counts.pop(id, None)
+        return Pool(counts)
+
+    def union(self, other: 'Pool') -> 'Pool':
+        """The smallest pool containing both pools, i.e. the max count of each card"""
+        counts = self.counts.copy()
+        for id, count in other.counts.items():
+            if count > counts.get(id, 0):
+                counts[id] = count
+        return Pool(counts)
+
+    def diff(self, other: 'Pool') -> tuple['Pool', 'Pool']:
+        """Returns (cards only in this pool, cards only in the other pool)"""
+        return self - other, other - self
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Pool) and self.counts == other.counts
+
+    def __len__(self) -> int:
+        return sum(self.counts.values())
+
+    def __iter__(self) -> Iterator[tuple[str, int]]:
+        return ((_card_names[id], count) for id, count in self.counts.items())
+
+    def __repr__(self) -> str:
+        return f'Pool({dict(self)})'
@@ -0,0 +1,452 @@
+"""
+Replays a trace recorded with the `trace_path` config option against a PoolBot wired to local stand-ins for Discord,
+Google Sheets and sealeddeck.tech, then reports throughput, queueing delay and the final spreadsheet and pool state.
+
+    python replay.py trace.jsonl --speed 10 --sheet pools.json --output state.json
+"""
+import argparse
+import asyncio
+import json
+import re
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional, Sequence
+
+import discord
+
+import PoolBot as poolbot_module
+import sealeddeck
+import utils
+from pool import Pool, SealedDeckEntry
+from storage import (FIRST_ROW, LeagueStorage, SheetsStorage, SqliteStorage, column_to_number, formatted_value,
+                     parse_range)
+
+FIRST_COL = 'B'
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class FakeRequest:
+    def __init__(self, result: dict = None):
+        self.result = result or dict()
+
+    def execute(self) -> dict:
+        return self.result
+
+
+class FakeSheet:
+    """Enough of the Sheets API for PoolBot: values().get/update/batchUpdate, grid data and formatting batchUpdate"""
+
+    def __init__(self, rows: Sequence[Sequence[str]] = ()):
+        self.cells: dict[tuple[int, int], str] = dict()
+        self.red_cells: set[tuple[int, int]] = set()
+        self.reads = 0
+        self.writes = 0
+        for offset, row in enumerate(rows):
+            for col_offset, value in enumerate(row):
+                if value != '':
+                    self.cells[(FIRST_ROW + offset, column_to_number(FIRST_COL) + col_offset)] = str(value)
+
+    def values(self) -> 'FakeSheet':
+        return self
+
+    def read(self, cell_range: str, value_render_option: str = "FORMATTED_VALUE") -> list[list[str]]:
+        self.reads += 1
+        first_row, first_col, last_row, last_col = parse_range(cell_range)
+        rows = []
+        for row in range(first_row, last_row + 1):
+            values = []
+            for col in range(first_col, last_col + 1):
+                value = self.cells.get((row, col), '')
+                values.append(value if value_render_option == "FORMULA" else formatted_value(value))
+            # Like the real API, drop trailing empty cells and rows
+            while values and values[-1] == '':
+                values.pop()
+            rows.append(values)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def get(self, spreadsheetId: str, range: str = None, valueRenderOption: str = "FORMATTED_VALUE",
+            ranges: Sequence[str] = (), fields: str = None) -> FakeRequest:
+        if ranges:
+            # spreadsheets().get rather than values().get
+            return FakeRequest({'sheets': [{'data': [{'rowData': self.grid(ranges[0])}]}]})
+        return FakeRequest({'values': self.read(range, valueRenderOption)})
+
+    def grid(self, cell_range: str) -> list[dict]:
+        """Grid data for a range, which carries each cell's formatted and entered value"""
+        self.reads += 1
+        first_row, first_col, last_row, last_col = parse_range(cell_range)
+        row_data = []
+        for row in range(first_row, last_row + 1):
+            cells = [self.cells.get((row, col), '') for col in range(first_col, last_col + 1)]
+            row_data.append({'values': [
+                {'formattedValue': formatted_value(value), 'userEnteredValue': (
+                    {'formulaValue': value} if value.startswith('=') else {'stringValue': value})}
+                if value != '' else {} for value in cells]})
+        return row_data
+
+    def write(self, cell_range: str, values: Sequence[Sequence]):
+        self.writes += 1
+        first_row, first_col, _, _ = parse_range(cell_range)
+        for row_offset, row in enumerate(values):
+            for col_offset, value in enumerate(row):
+                self.cells[(first_row + row_offset, first_col + col_offset)] = str(value)
+
+    def update(self, spreadsheetId: str, range: str, valueInputOption: str, body: dict) -> FakeRequest:
+        self.write(range, body['values'])
+        return FakeRequest()
+
+    def batchUpdate(self, spreadsheetId: str, body: dict) -> FakeRequest:
+        if 'data' in body:
+            for update in body['data']:
+                self.write(update['range'], update['values'])
+        for request in body.get('requests', []):
+            cell_range = request['updateCells']['range']
+            self.red_cells.add((cell_range['startRowIndex'] + 1, cell_range['startColumnIndex']))
+        return FakeRequest()
+
+    def rows(self) -> list[list[str]]:
+        last_row = max([row for row, _ in self.cells] + [FIRST_ROW])
+        return self.read(f'Pools!{FIRST_COL}{FIRST_ROW}:AA{last_row}', "FORMULA")
+
+
+class FakeSealeddeck:
+    def __init__(self, pools: dict[str, Sequence[SealedDeckEntry]] = None):
+        self.pools: dict[str, Sequence[SealedDeckEntry]] = dict(pools or {})
+        self.gets = 0
+        self.posts = 0
+
+    async def get(self, pool_sealeddeck_id: str) -> Optional[Sequence[SealedDeckEntry]]:
+        self.gets += 1
+        return self.pools.get(pool_sealeddeck_id)
+
+    async def fetch(self, pool_sealeddeck_id: str) -> Sequence[SealedDeckEntry]:
+        pool = await self.get(pool_sealeddeck_id)
+        if pool is None:
+            raise sealeddeck.PoolNotFoundError(f"sealeddeck.tech has no pool {pool_sealeddeck_id}")
+        return pool
+
+    async def post(self, cards: Sequence[SealedDeckEntry], pool_sealeddeck_id: Optional[str] = None) -> str:
+        self.posts += 1
+        pool = Pool.from_entries(cards)
+        if pool_sealeddeck_id:
+            pool = Pool.from_entries(self.pools.get(pool_sealeddeck_id, [])) + pool
+        pool_id = f'replay{len(self.pools)}'
+        self.pools[pool_id] = pool.to_entries()
+        return pool_id
+
+
+class FakeUser:
+    def __init__(self, world: 'World', id: int, name: str, display_name: str, bot: bool = False):
+        self.world = world
+        self.id = id
+        self.name = name
+        self.display_name = display_name
+        self.bot = bot
+        self.dms: list[str] = []
+
+    @property
+    def mention(self) -> str:
+        return f'<@{self.id}>'
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+    def __str__(self) -> str:
+        return self.name
+
+    async def send(self, content: str) -> 'FakeMessage':
+        self.dms.append(content)
+        return await self.world.dm_channel(self).send(content)
+
+    async def edit(self, username: str):
+        self.name = username
+
+
+class FakeChannel:
+    def __init__(self, world: 'World', id: int):
+        self.world = world
+        self.id = id
+        self.messages: dict[int, FakeMessage] = dict()
+
+    @property
+    def mention(self) -> str:
+        return f'<#{self.id}>'
+
+    @property
+    def last_message_id(self) -> Optional[int]:
+        return next(reversed(self.messages), None)
+
+    def add(self, message: 'FakeMessage'):
+        self.messages[message.id] = message
+
+    async def send(self, content: str) -> 'FakeMessage':
+        if not isinstance(self, FakeDMChannel):
+            self.world.sent += 1
+        mentions = [self.world.users[int(id)] for id in re.findall("<@!?([0-9]+)>", content)
+                    if int(id) in self.world.users]
+        message = FakeMessage(self.world.next_id(), content, self.world.bot_user, mentions, self,
+                              guild=not isinstance(self, FakeDMChannel))
+        self.add(message)
+        return message
+
+    async def history(self, limit: int = 100, before: Optional[discord.Object] = None,
+                      after: Optional[discord.Object] = None, oldest_first: bool = False):
+        messages = [message for message in self.messages.values()
+                    if (before is None or message.id < before.id) and (after is None or message.id > after.id)]
+        messages.sort(key=lambda message: message.id, reverse=not oldest_first)
+        for message in messages[:limit]:
+            yield message
+
+    async def fetch_message(self, id: int) -> 'FakeMessage':
+        return self.messages[id]
+
+
+class FakeDMChannel(FakeChannel):
+    pass
+
+
+class FakeMessage:
+    def __init__(self, id: int, content: str, author: FakeUser, mentions: Sequence[FakeUser], channel: FakeChannel,
+                 guild: bool = True, reference: Optional[int] = None):
+        self.id = id
+        self.content = content
+        self.author = author
+        self.mentions = list(mentions)
+        self.channel = channel
+        self.guild = SimpleNamespace(id=0) if guild else None
+        self.reference = SimpleNamespace(message_id=reference) if reference else None
+        self.created_at = datetime.now()
+
+    @property
+    def jump_url(self) -> str:
+        return f'https://discord.com/channels/{self.guild.id if self.guild else "@me"}/{self.channel.id}/{self.id}'
+
+    async def edit(self, content: str) -> 'FakeMessage':
+        self.content = content
+        return self
+
+    async def reply(self, content: str) -> 'FakeMessage':
+        return await self.channel.send(content)
+
+    async def delete(self):
+        self.channel.messages.pop(self.id, None)
+
+
+class World:
+    """Every user, channel and message the replayed bot can see"""
+
+    def __init__(self):
+        self.users: dict[int, FakeUser] = dict()
+        self.channels: dict[int, FakeChannel] = dict()
+        self.dm_channels: dict[int, FakeDMChannel] = dict()
+        self.bot_user = FakeUser(self, 0, 'AGL Bot', 'AGL Bot', bot=True)
+        self.sent = 0
+        self.last_id = 0
+
+    def next_id(self) -> int:
+        self.last_id += 1
+        return self.last_id
+
+    def user(self, data: dict) -> FakeUser:
+        if data["role"] == 'self':
+            return self.bot_user
+        if data["id"] not in self.users:
+            self.users[data["id"]] = FakeUser(self, data["id"], data["name"], data["display_name"], data["bot"])
+        return self.users[data["id"]]
+
+    def channel(self, id: int) -> FakeChannel:
+        if id not in self.channels:
+            self.channels[id] = FakeChannel(self, id)
+        return self.channels[id]
+
+    def dm_channel(self, user: FakeUser) -> FakeDMChannel:
+        if user.id not in self.dm_channels:
+            self.dm_channels[user.id] = FakeDMChannel(self, -user.id)
+        return self.dm_channels[user.id]
+
+
+class ReplayPoolBot(poolbot_module.PoolBot):
+    """PoolBot with Discord's connection state and league storage swapped out for a World and local stand-ins"""
+
+    def __init__(self, config: utils.Config, world: World, storage: LeagueStorage):
+        self.world = world
+        super().__init__(config, discord.Intents.none())
+        self.storage = storage
+
+    @property
+    def user(self) -> FakeUser:
+        return self.world.bot_user
+
+    @property
+    def users(self) -> list[FakeUser]:
+        return [self.world.bot_user, *self.world.users.values()]
+
+    def get_channel(self, id: int) -> FakeChannel:
+        return self.world.channel(id)
+
+
+class Replayer:
+    def __init__(self, bot: ReplayPoolBot, world: World, records: Sequence[dict], speed: float):
+        self.bot = bot
+        self.world = world
+        self.records = records
+        self.speed = speed
+        self.queue_delays: list[float] = []
+        self.handler_times: list[float] = []
+        self.errors = 0
+
+    def message(self, data: dict, content: Optional[str] = None) -> FakeMessage:
+        if data["dm"]:
+            channel = self.world.dm_channel(self.world.user(data["author"]))
+        elif data["channel"]["role"]:
+            channel = getattr(self.bot, data["channel"]["role"])
+        else:
+            channel = self.world.channel(data["channel"]["id"])
+        return FakeMessage(data["id"], data["content"] if content is None else content, self.world.user(data["author"]),
+                           [self.world.user(user) for user in data["mentions"]], channel, guild=not data["dm"],
+                           reference=data["reference"])
+
+    async def dispatch(self, record: dict, due: float):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.queue_delays.append(started - due)
+        try:
+            after = self.message(record["message"])
+            after.channel.add(after)
+            if record["event"] == "edit":
+                await self.bot.on_message_edit(self.message(record["before"]), after)
+            else:
+                await self.bot.on_message(after)
+        except Exception as e:
+            self.errors += 1
+            print(f"replay error handling message {record['message']['id']}: {e!r}")
+        self.handler_times.append(loop.time() - started)
+
+    async def run(self) -> float:
+        loop = asyncio.get_running_loop()
+        # Messages the bot sent itself will be re-sent by the replayed bot
+        records = [record for record in self.records if record["message"]["author"]["role"] != 'self']
+        start = loop.time()
+        first_at = records[0]["at"] if records else 0
+        tasks = []
+        for record in records:
+            due = start + ((record["at"] - first_at) / self.speed if self.speed else 0)
+            if due > loop.time():
+                await asyncio.sleep(due - loop.time())
+            tasks.append(asyncio.create_task(self.dispatch(record, due)))
+        await asyncio.gather(*tasks)
+        return loop.time() - start
+
+
+async def replay(trace: Sequence[dict], speed: float, sheet_rows: Sequence[Sequence[str]],
+                 pools: dict[str, Sequence[SealedDeckEntry]], storage_engine: str = 'sheets') -> dict:
+    world = World()
+    for record in trace:
+        for data in [record["message"], record.get("before", record["message"])]:
+            for user in [data["author"], *data["mentions"]]:
+                world.user(user)
+
+    fake_sheet = FakeSheet(sheet_rows)
+    fake_sealeddeck = FakeSealeddeck(pools)
+    sealeddeck.post_pool = fake_sealeddeck.post
+    poolbot_module.sealeddeck_pool = fake_sealeddeck.get
+    poolbot_module.fetch_pool = fake_sealeddeck.fetch
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = utils.Config(discord_token='', debug_mode='', spreadsheet_id='replay', pools_tab_id='0',
+                              ledger_path=str(Path(directory) / 'ledger.jsonl'),
+                              pack_index_path=str(Path(directory) / 'packs.sqlite3'))
+        storage = SheetsStorage('replay', '0', sheet=fake_sheet)
+        if storage_engine == 'sqlite':
+            storage = SqliteStorage(str(Path(directory) / 'league.sqlite3'), mirror=storage)
+            await storage.sync()
+        bot = ReplayPoolBot(config, world, storage)
+        await bot.on_ready()
+        replayer = Replayer(bot, world, trace, speed)
+        elapsed = await replayer.run()
+        # Push any spends still sitting in the ledger, and anything waiting on the mirror, so the final sheet is complete
+        await bot.sync_ledger()
+        await storage.sync()
+
+    handled = len(replayer.handler_times)
+    return {
+        "events": handled,
+        "seconds": elapsed,
+        "events_per_second": handled / elapsed if elapsed else None,
+        "queue_delay": {"p50": percentile(replayer.queue_delays, 0.5), "p95": percentile(replayer.queue_delays, 0.95),
+                        "max": max(replayer.queue_delays, default=0.0)},
+        "handler_time": {"p50": percentile(replayer.handler_times, 0.5),
+                         "p95": percentile(replayer.handler_times, 0.95),
+                         "max": max(replayer.handler_times, default=0.0)},
+        "errors": replayer.errors,
+        "messages_sent": world.sent,
+        "dms_sent": sum(len(user.dms) for user in world.users.values()),
+        "sheet_reads": fake_sheet.reads,
+        "sheet_writes": fake_sheet.writes,
+        "sealeddeck_gets": fake_sealeddeck.gets,
+        "sealeddeck_posts": fake_sealeddeck.posts,
+        "loop": bot.loop_monitor.summary(),
+        "sheet": fake_sheet.rows(),
+        "red_cells": sorted(fake_sheet.red_cells),
+        "pools": fake_sealeddeck.pools,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="replay",
+        description="Replay a recorded PoolBot event trace against local stand-ins.",
+    )
+    parser.add_argument("trace", help="JSONL trace recorded with the trace_path config option")
+    parser.add_argument(
+        "--speed",
+        default="1",
+        help="playback speed multiplier, e.g. 1 or 10, or 'max' to send events as fast as possible (default: 1)",
+    )
+    parser.add_argument("--sheet", help="JSON list of Pools!B7:AA200 rows to start from")
+    parser.add_argument("--pools", help="JSON object of sealeddeck.tech pool id -> cards to start from")
+    parser.add_argument(
+        "--storage",
+        choices=["sheets", "sqlite"],
+        default="sheets",
+        help="league storage engine to replay against; sqlite mirrors to the stand-in sheet (default: sheets)",
+    )
+    parser.add_argument("--output", help="write the full report, including final sheet and pools, to this file")
+    args = parser.parse_args()
+
+    with open(args.trace) as file:
+        trace = [json.loads(line) for line in file if line.strip()]
+    sheet_rows = json.loads(Path(args.sheet).read_text()) if args.sheet else []
+    pools = json.loads(Path(args.pools).read_text()) if args.pools else {}
+    speed = 0 if args.speed == 'max' else float(args.speed)
+
+    report = asyncio.run(replay(trace, speed, sheet_rows, pools, args.storage))
+    print(f"{report['events']} events in {report['seconds']:.2f}s ({report['events_per_second'] or 0:.1f}/s), "
+          f"{report['errors']} error(s)")
+    print(f"queue delay p50 {report['queue_delay']['p50'] * 1000:.1f}ms, "
+          f"p95 {report['queue_delay']['p95'] * 1000:.1f}ms, max {report['queue_delay']['max'] * 1000:.1f}ms")
+    print(f"handler time p50 {report['handler_time']['p50'] * 1000:.1f}ms, "
+          f"p95 {report['handler_time']['p95'] * 1000:.1f}ms, max {report['handler_time']['max'] * 1000:.1f}ms")
+    print(f"{report['messages_sent']} message(s) and {report['dms_sent']} DM(s) sent, "
+          f"{report['sheet_reads']} sheet read(s), {report['sheet_writes']} sheet write(s), "
+          f"{report['sealeddeck_gets']} sealeddeck GET(s), {report['sealeddeck_posts']} sealeddeck POST(s)")
+    print(report["loop"])
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import json
+import os.path
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Sequence, Union
+
+import aiohttp
+
+from pool import Pool, SealedDeckEntry
+
+SEALEDDECK_URL = "https://sealeddeck.tech/api/pools"
+# Give up on a single request after this long, rather than waiting on aiohttp's 5 minute default
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10)
+# POSTs aren't retried once sent, so give a slow one longer to finish before reporting it as failed
+POST_TIMEOUT = aiohttp.ClientTimeout(total=30)
+# Send a second copy of a GET once the first has taken longer than this percentile of recent successful requests
+HEDGE_PERCENTILE = 0.95
+
+
+class CircuitOpenError(Exception):
+    """Raised without making a request while sealeddeck.tech looks unhealthy"""
+
+
+class PoolNotFoundError(Exception):
+    """sealeddeck.tech answered, but doesn't have the requested pool"""
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of recent sealeddeck.tech requests. Once too many of them fail or run slow, requests are
+    refused for `open_seconds`, after which a single probe request decides whether to resume.
+    """
+
+    def __init__(self, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 5.0, open_seconds: float = 30.0):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def status(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.probing or time.monotonic() - self.opened_at >= self.open_seconds else 'open'
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        if len(self.latencies) < self.min_calls:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+    def _before_call(self) -> bool:
+        """Returns whether this call is the half-open probe"""
+        if self.opened_at is None:
+            return False
+        if self.probing or time.monotonic() - self.opened_at < self.open_seconds:
+            raise CircuitOpenError(f"sealeddeck.tech is unhealthy, not sending requests (circuit {self.status})")
+        self.probing = True
+        return True
+
+    def _record(self, ok: bool, latency: float, probe: bool):
+        healthy = ok and latency < self.slow_call_seconds
+        if ok:
+            self.latencies.append(latency)
+        if probe:
+            self.probing = False
+            if healthy:
+                self.opened_at = None
+                self.outcomes.clear()
+            else:
+                self.opened_at = time.monotonic()
+            return
+        self.outcomes.append(healthy)
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_rate:
+            self.opened_at = time.monotonic()
+
+    async def call(self, request):
+        probe = self._before_call()
+        start = time.monotonic()
+        try:
+            result = await request()
+        except asyncio.CancelledError:
+            # A cancelled hedge says nothing about the service's health
+            if probe:
+                self.probing = False
+            raise
+        except Exception as error:
+            if is_service_failure(error):
+                self._record(False, time.monotonic() - start, probe)
+            elif probe:
+                # sealeddeck.tech answered, even if it didn't like the request, so it's healthy enough to resume
+                self._record(True, time.monotonic() - start, probe)
+            raise
+        self._record(True, time.monotonic() - start, probe)
+        return result
+
+
+def is_service_failure(error: Exception) -> bool:
+    """
+    Whether an error says sealeddeck.tech is unhealthy (5xx responses, timeouts, connection errors, garbled bodies)
+    rather than that the request was bad, like a 404 for a deleted pool or a mistyped id
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError, ValueError))
+
+
+breaker = CircuitBreaker()
+
+
+async def hedged(request):
+    """Run an idempotent request through the breaker, racing a second copy if the first is unusually slow"""
+    hedge_delay = breaker.latency_percentile(HEDGE_PERCENTILE)
+    first = asyncio.ensure_future(breaker.call(request))
+    if hedge_delay is None:
+        return await first
+    done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+    if done:
+        return first.result()
+
+    pending = {first, asyncio.ensure_future(breaker.call(request))}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for loser in pending:
+            loser.cancel()
+
+
+class PoolIdCache:
+    """
+    Maps the content of a sealeddeck.tech POST to the pool id it produced, so replayed or retried posts of the same
+    cards reuse the existing pool instead of creating a new one. Recent entries are kept in an LRU, and optionally
+    appended to a file so they survive restarts. The file is rewritten from the LRU once it holds more than
+    `compact_factor` times as many entries.
+    """
+
+    def __init__(self, max_size: int = 4096, path: Optional[str] = None, compact_factor: int = 2):
+        self.max_size = max_size
+        self.compact_factor = compact_factor
+        self.path = None
+        # Entries in the file at `path`, including ones since evicted from the LRU
+        self.saved_entries = 0
+        self.pool_ids: OrderedDict[str, str] = OrderedDict()
+        self.in_flight: dict[str, asyncio.Future] = dict()
+        if path:
+            self.persist_to(path)
+
+    def persist_to(self, path: str):
+        """Load any entries already saved at `path`, and save new entries there from now on"""
+        self.path = path
+        self.saved_entries = 0
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._remember(record["key"], record["poolId"])
+                        self.saved_entries += 1
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if self.saved_entries <= self.max_size * self.compact_factor:
+            return
+        # Write the new file alongside and swap it in, so a crash mid-write can't lose the old entries
+        compacted_path = self.path + '.tmp'
+        with open(compacted_path, 'w') as file:
+            for key, pool_id in self.pool_ids.items():
+                file.write(json.dumps({"key": key, "poolId": pool_id}) + "\n")
+        os.replace(compacted_path, self.path)
+        self.saved_entries = len(self.pool_ids)
+
+    def _remember(self, key: str, pool_id: str):
+        self.pool_ids[key] = pool_id
+        self.pool_ids.move_to_end(key)
+        while len(self.pool_ids) > self.max_size:
+            self.pool_ids.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        pool_id = self.pool_ids.get(key)
+        if pool_id is not None:
+            self.pool_ids.move_to_end(key)
+        return pool_id
+
+    def put(self, key: str, pool_id: str):
+        self._remember(key, pool_id)
+        if self.path:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps({"key": key, "poolId": pool_id}) + "\n")
+            self.saved_entries += 1
+            self._compact_if_needed()
+
+    def finish(self, key: str, future: asyncio.Future):
+        del self.in_flight[key]
+        if not future.cancelled() and future.exception() is None:
+            self.put(key, future.result())
+
+
+pool_id_cache = PoolIdCache()
+
+
+def canonical_cards(cards: Sequence[SealedDeckEntry]) -> Sequence[SealedDeckEntry]:
+    """Merge duplicate entries and sort by name, so equal card lists always serialize the same way"""
+    return sorted(Pool.from_entries(cards).to_entries(), key=lambda card: card["name"])
+
+
+def content_key(cards: Sequence[SealedDeckEntry], pool_sealeddeck_id: Optional[str]) -> str:
+    payload = json.dumps({"sideboard": cards, "poolId": pool_sealeddeck_id}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def fetch_pool(pool_sealeddeck_id: str) -> Sequence[SealedDeckEntry]:
+    """
+    Fetch a pool's cards. Raises PoolNotFoundError if sealeddeck.tech doesn't have the pool, or the last error if it
+    couldn't be reached.
+    """
+    async def get():
+        async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
+            async with session.get(f"{SEALEDDECK_URL}/{pool_sealeddeck_id}") as resp:
+                resp.raise_for_status()
+                return await resp.json()
+
+    for attempt in range(3):
+        try:
+            resp_json = await hedged(get)
+        except CircuitOpenError:
+            raise
+        except aiohttp.ClientResponseError as e:
+            # Asking again won't make a missing pool or a bad id work
+            if e.status == 404:
+                raise PoolNotFoundError(f"sealeddeck.tech has no pool {pool_sealeddeck_id}") from e
+            if e.status < 500 or attempt == 2:
+                raise
+        except Exception:
+            if attempt == 2:
+                raise
+        else:
+            return [*resp_json["sideboard"], *resp_json["deck"], *resp_json["hidden"]]
+
+
+async def sealeddeck_pool(pool_sealeddeck_id: str) -> Optional[Sequence[SealedDeckEntry]]:
+    """Fetch a pool's cards, or None if sealeddeck.tech couldn't provide them"""
+    try:
+        return await fetch_pool(pool_sealeddeck_id)
+    except Exception:
+        return None
+
+
+async def post_pool(cards: Sequence[SealedDeckEntry], pool_sealeddeck_id: Optional[str] = None) -> str:
+    deck: dict[str, Union[Sequence[dict], str]] = {"sideboard": cards}
+    if pool_sealeddeck_id:
+        deck["poolId"] = pool_sealeddeck_id
+
+    async def post():
+        async with aiohttp.ClientSession(timeout=POST_TIMEOUT) as session:
+            async with session.post(SEALEDDECK_URL, json=deck) as resp:
+                resp.raise_for_status()
+                return await resp.json()
+
+    # POSTs create a new pool each time, so they're never hedged, and only retried when the connection couldn't be
+    # made. After a timeout or a failed read the pool may well exist already, so the error goes to the caller.
+    for attempt in range(3):
+        try:
+            resp_json = await breaker.call(post)
+        except aiohttp.ClientConnectorError:
+            if attempt == 2:
+                raise
+            continue
+        return resp_json["poolId"]
+
+
+async def pool_to_sealeddeck(
+        punishment_cards: Sequence[SealedDeckEntry], pool_sealeddeck_id: Optional[str] = None
+) -> str:
+    """
+    Adds punishment cards to a sealeddeck.tech pool and returns the id. Posting the same cards to the same base pool
+    again returns the known id without a request, and identical concurrent posts share a single request.
+    """
+    cards = canonical_cards(punishment_cards)
+    key = content_key(cards, pool_sealeddeck_id)
+    pool_id = pool_id_cache.get(key)
+    if pool_id is not None:
+        return pool_id
+
+    in_flight = pool_id_cache.in_flight.get(key)
+    if in_flight is not None:
+        return await asyncio.shield(in_flight)
+
+    # Shield the shared request so one caller being cancelled doesn't cancel it for everyone else
+    in_flight = asyncio.ensure_future(post_pool(cards, pool_sealeddeck_id))
+    pool_id_cache.in_flight[key] = in_flight
+    in_flight.add_done_callback(lambda future: pool_id_cache.finish(key, future))
+    return await asyncio.shield(in_flight)
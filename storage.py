@@ -0,0 +1,419 @@
+import itertools
+import json
+import os.path
+import re
+import sqlite3
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional, List, Sequence
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+# Player rows on the Pools tab. Rows are read starting at column B, see column_index.
+FIRST_ROW = 7
+LAST_ROW = 200
+POOLS_RANGE = f'Pools!B{FIRST_ROW}:AA{LAST_ROW}'
+NAME_INDEX = 0
+LOSSES_INDEX = 2
+
+
+def column_to_number(col: str) -> int:
+    """Zero-based sheet column number, e.g. A -> 0, AA -> 26"""
+    number = 0
+    for letter in col:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number - 1
+
+
+def column_index(col: str) -> int:
+    """Index of a column within a row read from column B onwards"""
+    return column_to_number(col) - column_to_number('B')
+
+
+def number_to_column(number: int) -> str:
+    col = ''
+    number += 1
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        col = chr(ord('A') + remainder) + col
+    return col
+
+
+def parse_range(cell_range: str) -> tuple[int, int, int, int]:
+    """Turn a range like 'Pools!B7:AA200' into (first row, first column number, last row, last column number)"""
+    start, end = cell_range.split('!')[-1].split(':')
+    start_col, start_row = re.match("([A-Z]+)([0-9]+)", start).groups()
+    end_col, end_row = re.match("([A-Z]+)([0-9]+)", end).groups()
+    return int(start_row), column_to_number(start_col), int(end_row), column_to_number(end_col)
+
+
+def cell_int(row: Sequence[str], index: int) -> int:
+    """Read an integer cell, treating missing or blank cells as 0"""
+    if index >= len(row) or row[index] == '':
+        return 0
+    return int(row[index])
+
+
+def cell_text(row: Sequence[str], index: int) -> str:
+    """Read a cell as text, treating missing cells as blank"""
+    return str(row[index]) if index < len(row) else ''
+
+
+def cell_update(col: str, row: int, value) -> dict:
+    """A single-cell entry for `LeagueStorage.write`"""
+    return {'range': f'Pools!{col}{row}:{col}{row}', 'values': [[value]]}
+
+
+def formatted_value(value: str) -> str:
+    """What the sheet displays for a cell, which for our HYPERLINK formulas is the link text"""
+    hyperlink = re.match('=HYPERLINK\\("[^"]*", "([^"]*)"\\)', value)
+    return hyperlink.group(1) if hyperlink else value
+
+
+@dataclass(frozen=True)
+class PlayerRow:
+    row: int
+    values: Sequence[str]
+    formulas: Sequence[str]
+
+    def _cell(self, cells: Sequence[str], col: str) -> str:
+        index = column_index(col)
+        return cells[index] if index < len(cells) else ''
+
+    @property
+    def name(self) -> str:
+        return self.values[NAME_INDEX]
+
+    @property
+    def losses(self) -> int:
+        return cell_int(self.values, LOSSES_INDEX)
+
+    @property
+    def pool_link(self) -> str:
+        return self._cell(self.values, 'E')
+
+    @property
+    def starting_pool_link(self) -> str:
+        return self._cell(self.values, 'S')
+
+    def pack_link(self, loss_count: int) -> str:
+        """The HYPERLINK formula for the pack recorded for the given loss"""
+        return self._cell(self.formulas, chr(ord('F') + loss_count))
+
+    @property
+    def extra_cards(self) -> List[str]:
+        # Columns T through Z inclusive have extra cards
+        return [card for card in self.values[column_index('T'):column_index('Z') + 1] if card != '']
+
+    @property
+    def extra_card_count(self) -> int:
+        return cell_int(self.values, column_index('AA'))
+
+
+class LeagueStorage(ABC):
+    """The Pools tab operations PoolBot's handlers need, independent of where the data lives"""
+
+    @abstractmethod
+    async def rows(self, formulas: bool = False) -> Sequence[Sequence[str]]:
+        """Every player row (Pools!B7:AA200), with formulas instead of their results if `formulas` is set"""
+
+    @abstractmethod
+    async def write(self, data: Sequence[dict]):
+        """Write a batch of `{'range': ..., 'values': ...}` entries, in the Sheets batchUpdate shape"""
+
+    @abstractmethod
+    async def mark_error(self, row: int, col: str):
+        """Highlight a cell red so the league committee knows to fix it by hand"""
+
+    async def rows_and_formulas(self) -> tuple[Sequence[Sequence[str]], Sequence[Sequence[str]]]:
+        """Every player row as both values and formulas. Backends that can should read both at once."""
+        return await self.rows(), await self.rows(formulas=True)
+
+    async def refresh_sheet_owned(self):
+        """
+        Re-read the cells only the league committee edits on the sheet (names and losses), for storage that keeps a
+        local copy. Called before acting on a player's loss count.
+        """
+
+    async def sync(self) -> bool:
+        """
+        Bring the storage up to date with anything it mirrors. Called periodically. Returns whether the storage now
+        matches the mirror, including values the mirror computes from what was just pushed.
+        """
+        return True
+
+    async def find_player(self, display_name: str, min_cells: int = 5,
+                          formulas: bool = False) -> Optional[PlayerRow]:
+        if formulas:
+            values, formula_rows = await self.rows_and_formulas()
+        else:
+            values = formula_rows = await self.rows()
+        for offset, (row, formula_row) in enumerate(zip(values, formula_rows)):
+            if len(row) < min_cells:
+                continue
+            if row[NAME_INDEX].lower() != '' and row[NAME_INDEX].lower() in display_name.lower():
+                return PlayerRow(FIRST_ROW + offset, row, formula_row)
+        return None
+
+
+class SheetsStorage(LeagueStorage):
+    """Reads and writes the league Google Sheet directly. `sheet` can be passed in place of a real API client."""
+
+    def __init__(self, spreadsheet_id: str, pools_tab_id: str, sheet=None):
+        self.spreadsheet_id = spreadsheet_id
+        self.pools_tab_id = pools_tab_id
+        self.sheet = sheet
+        self.creds = None
+
+    def spreadsheets(self):
+        if self.sheet is not None and (self.creds is None or self.creds.valid):
+            return self.sheet
+        # The file token.json stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time.
+        if self.creds is None and os.path.exists('token.json'):
+            self.creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+        # If there are no (valid) credentials available, let the user log in.
+        if not self.creds or not self.creds.valid:
+            if self.creds and self.creds.expired and self.creds.refresh_token:
+                self.creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+                self.creds = flow.run_local_server(port=0)
+            # Save the credentials for the next run
+            with open('token.json', 'w') as token:
+                token.write(self.creds.to_json())
+        self.sheet = build('sheets', 'v4', credentials=self.creds).spreadsheets()
+        return self.sheet
+
+    async def rows(self, formulas: bool = False) -> Sequence[Sequence[str]]:
+        try:
+            result = self.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id, range=POOLS_RANGE,
+                valueRenderOption="FORMULA" if formulas else "FORMATTED_VALUE").execute()
+            return result.get('values', [])
+        except HttpError as err:
+            print(err)
+        return []
+
+    async def rows_and_formulas(self) -> tuple[Sequence[Sequence[str]], Sequence[Sequence[str]]]:
+        # The values API renders one way per request, so ask for the grid data, which has both, in a single call
+        try:
+            result = self.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id, ranges=[POOLS_RANGE],
+                fields='sheets(data(rowData(values(formattedValue,userEnteredValue))))').execute()
+        except HttpError as err:
+            print(err)
+            return [], []
+        values: List[List[str]] = []
+        formulas: List[List[str]] = []
+        for row_data in result['sheets'][0]['data'][0].get('rowData', []):
+            cells = row_data.get('values', [])
+            values.append([cell.get('formattedValue', '') for cell in cells])
+            formulas.append([cell.get('userEnteredValue', {}).get('formulaValue', cell.get('formattedValue', ''))
+                             for cell in cells])
+        # Match the values API, which leaves out trailing empty cells and rows
+        for rows in (values, formulas):
+            for cells in rows:
+                while cells and cells[-1] == '':
+                    cells.pop()
+            while rows and not rows[-1]:
+                rows.pop()
+        return values, formulas
+
+    async def write(self, data: Sequence[dict]):
+        if not data:
+            return
+        self.spreadsheets().values().batchUpdate(spreadsheetId=self.spreadsheet_id,
+                                                 body={'valueInputOption': 'USER_ENTERED', 'data': data}).execute()
+
+    async def mark_error(self, row: int, col: str):
+        # Note that this request (annoyingly) uses indices instead of the regular cell format.
+        color_body = {
+            'requests': [{
+                'updateCells': {
+                    'rows': [{
+                        'values': [{
+                            'userEnteredFormat': {
+                                'backgroundColorStyle': {
+                                    'rgbColor': {
+                                        "red": 1,
+                                        "green": 0,
+                                        "blue": 0,
+                                        "alpha": 1,
+                                    }
+                                }
+                            }
+                        }]
+                    }],
+                    'fields': 'userEnteredFormat',
+                    'range': {
+                        'sheetId': self.pools_tab_id,
+                        'startRowIndex': row - 1,
+                        'endRowIndex': row,
+                        'startColumnIndex': column_to_number(col),
+                        'endColumnIndex': column_to_number(col) + 1,
+                    },
+                },
+            }],
+        }
+        self.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body=color_body).execute()
+
+
+class SqliteStorage(LeagueStorage):
+    """
+    Keeps the Pools tab in a local SQLite database. With a `mirror`, every write is also queued for the mirror, and
+    `sync` pushes the queue in one batch and then pulls the mirror's current contents back in, so edits made on the
+    sheet by hand (and values the sheet computes) still show up.
+    """
+
+    def __init__(self, path: str, mirror: Optional[LeagueStorage] = None):
+        self.mirror = mirror
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS cells (
+                row INTEGER NOT NULL,
+                col INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                formula TEXT NOT NULL,
+                error INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (row, col)
+            );
+            CREATE TABLE IF NOT EXISTS mirror_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL
+            );
+        ''')
+
+    def load(self, values: Sequence[Sequence[str]], formulas: Sequence[Sequence[str]]):
+        """Replace every cell with the given Pools!B7:AA200 rows"""
+        first_col = column_to_number('B')
+        cells = []
+        for offset, (row, formula_row) in enumerate(zip(values, formulas)):
+            for col_offset in range(max(len(row), len(formula_row))):
+                value = row[col_offset] if col_offset < len(row) else ''
+                formula = formula_row[col_offset] if col_offset < len(formula_row) else value
+                if value != '' or formula != '':
+                    cells.append((FIRST_ROW + offset, first_col + col_offset, str(value), str(formula)))
+        with self.db:
+            self.db.execute('DELETE FROM cells')
+            self.db.executemany('INSERT INTO cells (row, col, value, formula) VALUES (?, ?, ?, ?)', cells)
+
+    async def rows(self, formulas: bool = False) -> Sequence[Sequence[str]]:
+        values, formula_rows = await self.rows_and_formulas()
+        return formula_rows if formulas else values
+
+    async def rows_and_formulas(self) -> tuple[Sequence[Sequence[str]], Sequence[Sequence[str]]]:
+        first_col = column_to_number('B')
+        last_col = column_to_number('AA')
+        values: List[List[str]] = []
+        formulas: List[List[str]] = []
+        for row, col, value, formula in self.db.execute(
+                'SELECT row, col, value, formula FROM cells '
+                'WHERE row BETWEEN ? AND ? AND col BETWEEN ? AND ? ORDER BY row, col',
+                (FIRST_ROW, LAST_ROW, first_col, last_col)):
+            for rows, text in ((values, value), (formulas, formula)):
+                while len(rows) <= row - FIRST_ROW:
+                    rows.append([])
+                cells = rows[row - FIRST_ROW]
+                while len(cells) < col - first_col:
+                    cells.append('')
+                cells.append(text)
+        return values, formulas
+
+    async def write(self, data: Sequence[dict]):
+        if not data:
+            return
+        cells = []
+        for update in data:
+            first_row, first_col, _, _ = parse_range(update['range'])
+            for row_offset, row in enumerate(update['values']):
+                for col_offset, value in enumerate(row):
+                    cells.append((first_row + row_offset, first_col + col_offset,
+                                  formatted_value(str(value)), str(value)))
+        with self.db:
+            self.db.executemany('INSERT INTO cells (row, col, value, formula) VALUES (?, ?, ?, ?) '
+                                'ON CONFLICT (row, col) DO UPDATE SET value = excluded.value, '
+                                'formula = excluded.formula', cells)
+            if self.mirror:
+                self.db.execute('INSERT INTO mirror_queue (kind, payload) VALUES (?, ?)',
+                                ('values', json.dumps(list(data))))
+
+    async def mark_error(self, row: int, col: str):
+        with self.db:
+            self.db.execute("INSERT INTO cells (row, col, value, formula, error) VALUES (?, ?, '', '', 1) "
+                            "ON CONFLICT (row, col) DO UPDATE SET error = 1", (row, column_to_number(col)))
+            if self.mirror:
+                self.db.execute('INSERT INTO mirror_queue (kind, payload) VALUES (?, ?)',
+                                ('error', json.dumps({'row': row, 'col': col})))
+
+    def error_cells(self) -> List[tuple[int, str]]:
+        return [(row, number_to_column(col)) for row, col in self.db.execute(
+            'SELECT row, col FROM cells WHERE error = 1 ORDER BY row, col')]
+
+    async def refresh_sheet_owned(self):
+        """
+        Pull names and losses from the mirror without waiting for the next sync. Rows whose name changed (a player
+        added or moved on the sheet) are pulled in full. Everything else is left alone, since it may hold local writes
+        that haven't been pushed yet.
+        """
+        if self.mirror is None:
+            return
+        values, formulas = await self.mirror.rows_and_formulas()
+        if not values:
+            return
+        local_values = await self.rows()
+        first_col = column_to_number('B')
+        upserts = []
+        deletes = []
+        for offset, (row, formula_row) in enumerate(itertools.zip_longest(values, formulas, fillvalue=[])):
+            local_row = local_values[offset] if offset < len(local_values) else []
+            if cell_text(local_row, NAME_INDEX) == cell_text(row, NAME_INDEX):
+                col_offsets = [LOSSES_INDEX]
+            else:
+                col_offsets = range(max(len(row), len(formula_row), len(local_row)))
+            for col_offset in col_offsets:
+                value = cell_text(row, col_offset)
+                formula = cell_text(formula_row, col_offset) or value
+                cell = (FIRST_ROW + offset, first_col + col_offset)
+                if value == '' and formula == '':
+                    deletes.append(cell)
+                else:
+                    upserts.append((*cell, value, formula))
+        with self.db:
+            # Cells marked red stay, so the mark isn't lost
+            self.db.executemany('DELETE FROM cells WHERE row = ? AND col = ? AND error = 0', deletes)
+            self.db.executemany("UPDATE cells SET value = '', formula = '' WHERE row = ? AND col = ?", deletes)
+            self.db.executemany('INSERT INTO cells (row, col, value, formula) VALUES (?, ?, ?, ?) '
+                                'ON CONFLICT (row, col) DO UPDATE SET value = excluded.value, '
+                                'formula = excluded.formula', upserts)
+
+    async def sync(self) -> bool:
+        if self.mirror is None:
+            return True
+        queued = self.db.execute('SELECT id, kind, payload FROM mirror_queue ORDER BY id').fetchall()
+        data = []
+        for _, kind, payload in queued:
+            if kind == 'values':
+                data.extend(json.loads(payload))
+            else:
+                error = json.loads(payload)
+                await self.mirror.mark_error(error['row'], error['col'])
+        await self.mirror.write(data)
+        if queued:
+            with self.db:
+                self.db.execute('DELETE FROM mirror_queue WHERE id <= ?', (queued[-1][0],))
+
+        # Only take the mirror's contents if nothing was written locally while pushing
+        values, formulas = await self.mirror.rows_and_formulas()
+        pending = self.db.execute('SELECT COUNT(*) FROM mirror_queue').fetchone()[0]
+        if values and pending == 0:
+            self.load(values, formulas)
+            return True
+        return False
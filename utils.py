@@ -1,5 +1,6 @@
 from pathlib import Path
 from dataclasses import dataclass
+from typing import Optional
 
 import yaml
 
@@ -10,6 +11,16 @@ class Config:
 	debug_mode: str
 	spreadsheet_id: str
 	pools_tab_id: str
+	ledger_path: str = "ledger.jsonl"
+	ledger_sync_seconds: int = 60
+	sealeddeck_cache_path: Optional[str] = None
+	stall_threshold_seconds: float = 0.25
+	trace_path: Optional[str] = None
+	lfm_expiry_minutes: int = 60
+	pack_index_path: str = "packs.sqlite3"
+	storage: str = "sheets"
+	storage_path: str = "league.sqlite3"
+	pack_job_timeout_minutes: int = 10
 
 
 def get_config(path: Path = Path("config.yaml")) -> Config: